@@ -0,0 +1,85 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Measure how fast breakpoints reach the server, one by one and in bulk.
+
+Usage:
+    python -m benchmarks.breakpoints [count]
+"""
+
+import sys
+import threading
+import time
+
+from pydevc.client import PyDevClient
+
+from .fake_pydevd import FakePyDevServer, CMD_SET_BREAK
+
+
+def bench_breakpoints(count=5000):
+    """Time setting count breakpoints until the server has received all of
+    them, with add_breakpoint calls and with a single add_breakpoints."""
+    received = [0]
+    done = threading.Event()
+
+    def _on_set_break(_args):
+        received[0] += 1
+        if received[0] == count:
+            done.set()
+
+    server = FakePyDevServer({CMD_SET_BREAK: _on_set_break})
+    server.start()
+
+    client = PyDevClient(server.host, server.port)
+    client.connect()
+    client.start()
+    client.init('1.0')
+
+    def _measure(add):
+        received[0] = 0
+        done.clear()
+        t0 = time.perf_counter()
+        add()
+        done.wait(timeout=60)
+        elapsed = time.perf_counter() - t0
+        client.remove_breakpoints(list(client.breakpoints))
+        return count / elapsed
+
+    def _single():
+        for line in range(1, count + 1):
+            client.add_breakpoint('/srv/app/module.py', line)
+
+    def _batch():
+        client.add_breakpoints([
+            {'filename': '/srv/app/module.py', 'line_number': line}
+            for line in range(1, count + 1)
+        ])
+
+    result = {
+        'breakpoints': count,
+        'single_per_second': _measure(_single),
+        'batch_per_second': _measure(_batch),
+    }
+    server.close()
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    result = bench_breakpoints(count)
+    print('{breakpoints} breakpoints: {single_per_second:.0f}/s one by one, '
+          '{batch_per_second:.0f}/s in bulk'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
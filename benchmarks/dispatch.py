@@ -0,0 +1,132 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Measure how fast the client dispatches bursts of spontaneous events.
+
+Usage:
+    python -m benchmarks.dispatch [count]
+"""
+
+import sys
+import threading
+import time
+
+from pydevc.client import PyDevClient
+
+from .fake_pydevd import (
+    FakePyDevServer,
+    CMD_THREAD_CREATE,
+    CMD_THREAD_SUSPEND,
+    suspend_payload,
+)
+
+
+def bench_dispatch(count=20000):
+    """Send count CMD_THREAD_CREATE events in one write and time handling."""
+    server = FakePyDevServer()
+    server.start()
+
+    client = PyDevClient(server.host, server.port)
+    client.connect()
+
+    done = threading.Event()
+    received = []
+
+    def _on_create(thread_id, _name):
+        received.append(thread_id)
+        if len(received) == count:
+            done.set()
+
+    client.callbacks[PyDevClient.EVENT_THREAD_CREATE] = _on_create
+    client.start()
+    server.connected.wait()
+
+    burst = b''.join(
+        '{}\t{}\t<xml><thread name="worker-{}" id="pid_1_id_{}" /></xml>\n'
+        .format(CMD_THREAD_CREATE, 2 * (i + 1), i, i).encode('utf-8')
+        for i in range(count)
+    )
+
+    t0 = time.perf_counter()
+    server.send_raw(burst)
+    done.wait(timeout=60)
+    elapsed = time.perf_counter() - t0
+    server.close()
+
+    in_order = received == ['pid_1_id_{}'.format(i) for i in range(count)]
+    return {
+        'messages': len(received),
+        'seconds': elapsed,
+        'messages_per_second': len(received) / elapsed,
+        'in_order': in_order,
+    }
+
+
+def bench_suspend(count=10000, threads=100, depth=20):
+    """Send count CMD_THREAD_SUSPEND events for stacks of the given depth,
+    spread over threads, in one write and time handling."""
+    server = FakePyDevServer()
+    server.start()
+
+    client = PyDevClient(server.host, server.port)
+    client.connect()
+
+    done = threading.Event()
+    received = []
+
+    def _on_suspend(_filename, line, _function):
+        received.append(line)
+        if len(received) == count:
+            done.set()
+
+    client.callbacks[PyDevClient.EVENT_THREAD_SUSPEND] = _on_suspend
+    client.start()
+    server.connected.wait()
+
+    burst = b''.join(
+        '{}\t{}\t{}\n'.format(CMD_THREAD_SUSPEND, 2 * (i + 1), suspend_payload(
+            'pid_1_id_{}'.format(i % threads),
+            [('{}_{}'.format(i, d), 'function_{}'.format(d),
+              '/srv/app/module_{}.py'.format(d), i + 1)
+             for d in range(depth)])).encode('utf-8')
+        for i in range(count)
+    )
+
+    t0 = time.perf_counter()
+    server.send_raw(burst)
+    done.wait(timeout=60)
+    elapsed = time.perf_counter() - t0
+    server.close()
+
+    return {
+        'messages': len(received),
+        'seconds': elapsed,
+        'messages_per_second': len(received) / elapsed,
+        'in_order': received == list(range(1, count + 1)),
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    result = bench_dispatch(count)
+    print('{messages} create events in {seconds:.3f} s: '
+          '{messages_per_second:.0f} msg/s (in order: {in_order})'
+          .format(**result))
+    result = bench_suspend(count // 2)
+    print('{messages} suspend events in {seconds:.3f} s: '
+          '{messages_per_second:.0f} msg/s (in order: {in_order})'
+          .format(**result))
+
+
+if __name__ == '__main__':
+    main()
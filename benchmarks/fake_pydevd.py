@@ -0,0 +1,151 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""A minimal in-process stand-in for pydevd used by the benchmarks.
+
+The server speaks the same tab-separated, newline-terminated protocol as
+pydevd: client messages carry odd ids, replies echo the id of the request and
+spontaneous events use even ids.
+"""
+
+import socket
+import threading
+import urllib.parse
+
+
+CMD_LIST_THREADS = 102
+CMD_THREAD_CREATE = 103
+CMD_THREAD_KILL = 104
+CMD_THREAD_SUSPEND = 105
+CMD_STEP_OVER = 108
+CMD_SET_BREAK = 111
+CMD_GET_FRAME = 114
+CMD_VERSION = 501
+
+THREADS_XML = '<xml><thread name="MainThread" id="pid_1234_id_1" /></xml>'
+
+
+class FakePyDevServer(threading.Thread):
+    """Accept one connection and answer requests with canned replies.
+
+    Handlers are looked up by command id. A handler receives the arguments of
+    the request and returns the payload of the reply, or None if no reply is
+    to be sent.
+    """
+
+    def __init__(self, handlers=None):
+        super().__init__(daemon=True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.host, self.port = self.sock.getsockname()
+        self.conn = None
+        self.connected = threading.Event()
+
+        self.event_id = 2
+        self.write_lock = threading.Lock()
+
+        self.handlers = {
+            CMD_VERSION: lambda args: '1.1.1',
+            CMD_LIST_THREADS: lambda args: THREADS_XML,
+        }
+        self.handlers.update(handlers or {})
+
+    def run(self):
+        self.conn, _addr = self.sock.accept()
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connected.set()
+
+        buf = b''
+        while True:
+            try:
+                data = self.conn.recv(65536)
+            except OSError:
+                # Closed by close() while waiting for data.
+                return
+            if not data:
+                return
+            buf += data
+            *messages, buf = buf.split(b'\n')
+            for message in messages:
+                self.__handle(message.decode('utf-8'))
+
+    def __handle(self, message):
+        cmd, msg_id, *args = message.split('\t')
+        handler = self.handlers.get(int(cmd))
+        if handler is None:
+            return
+        reply = handler(args)
+        if reply is not None:
+            self.send(cmd, msg_id, reply)
+
+    def send(self, cmd, msg_id, payload=''):
+        """Send a single message to the client."""
+        self.send_raw('{}\t{}\t{}\n'.format(cmd, msg_id, payload)
+                      .encode('utf-8'))
+
+    def send_event(self, cmd, payload=''):
+        """Send a spontaneous event to the client."""
+        with self.write_lock:
+            msg_id = self.event_id
+            self.event_id += 2
+        self.send(cmd, msg_id, payload)
+
+    def send_raw(self, data):
+        """Write raw bytes to the client."""
+        self.connected.wait()
+        with self.write_lock:
+            self.conn.sendall(data)
+
+    def close(self):
+        """Close the connection, the client will see the server exit."""
+        if self.conn is not None:
+            self.conn.shutdown(socket.SHUT_RDWR)
+            self.conn.close()
+        self.sock.close()
+
+
+def quote_attr(value):
+    """Quote an attribute value the way pydevd does."""
+    return urllib.parse.quote(value, '/>_= ').replace('"', '&quot;')
+
+
+def quote_message(text):
+    """Quote the text of a message the way pydevd does."""
+    return urllib.parse.quote(text, '/<>_=" \t')
+
+
+def suspend_payload(thread_id, frames, stop_reason=CMD_STEP_OVER):
+    """A thread suspend event, frames given innermost first as
+    (id, function, file, line)."""
+    frames = ''.join(
+        '<frame id="{}" name="{}" file="{}" line="{}"></frame>'.format(
+            frame_id, quote_attr(function), quote_attr(filename), line)
+        for frame_id, function, filename, line in frames
+    )
+    return quote_message('<xml><thread id="{}" stop_reason="{}">{}'
+                         '</thread></xml>'.format(thread_id, stop_reason,
+                                                  frames))
+
+
+def frame_payload(count=5000):
+    """A frame with the given number of local variables."""
+    variables = ''.join(
+        '<var name="{}" type="dict" qualifier="builtins" value="{}" '
+        'isContainer="True" />'.format(
+            quote_attr('var_{}'.format(i)),
+            quote_attr(repr({'key': 'value é <{}>'.format(i) * 10})))
+        for i in range(count)
+    )
+    return quote_message('<xml>{}</xml>'.format(variables))
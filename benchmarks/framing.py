@@ -0,0 +1,123 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Check and time the splitting of the byte stream into messages.
+
+Messages with multi-byte characters are sent through a socket pair in chunks
+of a few bytes, so that reads end inside a character, followed by a frame
+many times larger than the receive buffer. The decoded messages must match
+what was sent.
+
+Usage:
+    python -m benchmarks.framing
+"""
+
+import itertools
+import socket
+import threading
+import time
+
+from pydevc.transport import RECV_BUFFER_SIZE, MessageReader
+
+from .fake_pydevd import CMD_THREAD_CREATE
+
+# Lengths of the chunks the small messages are sent in, one to seven bytes so
+# that the reads split the two, three and four byte characters at every
+# position.
+SMALL_CHUNKS = (1, 2, 3, 5, 7)
+
+# Chunk length of the large frame, odd so its characters are split too.
+LARGE_CHUNK = 4093
+
+
+def small_messages(count):
+    return ['{}\t{}\t<xml><thread name="wörker-€-😀-{}" id="pid_1_id_{}" '
+            '/></xml>'.format(CMD_THREAD_CREATE, 2 * (i + 1), i, i)
+            for i in range(count)]
+
+
+def large_message(size):
+    """A message of about size bytes, mixing one to four byte characters."""
+    return 'x' + 'aé€😀' * (size // 10)
+
+
+def _send(conn, data, chunks):
+    try:
+        offset = 0
+        for chunk in chunks:
+            if offset >= len(data):
+                break
+            conn.sendall(data[offset:offset + chunk])
+            offset += chunk
+        conn.shutdown(socket.SHUT_WR)
+    finally:
+        conn.close()
+
+
+def feed(messages, chunks):
+    """Send messages through a MessageReader in the given chunk lengths.
+
+    Returns the reader and the messages it yielded.
+    """
+    ours, theirs = socket.socketpair()
+    data = b''.join(m.encode('utf-8') + b'\n' for m in messages)
+    sender = threading.Thread(target=_send, args=(ours, data, chunks),
+                              daemon=True)
+    sender.start()
+
+    reader = MessageReader(theirs)
+    received = list(reader)
+    sender.join()
+    theirs.close()
+
+    assert received == messages
+    assert reader.bytes_received == len(data)
+    assert reader.messages_received == len(messages)
+    # The buffer grown for a large frame goes back to its initial size.
+    assert len(reader.buf) == reader.bufsize
+    return reader, received
+
+
+def bench_framing(count=2000, size=4 * 1024 * 1024):
+    t0 = time.perf_counter()
+    feed(small_messages(count), itertools.cycle(SMALL_CHUNKS))
+    small = time.perf_counter() - t0
+
+    messages = small_messages(10) + [large_message(size)] + small_messages(10)
+    large_bytes = len(messages[10].encode('utf-8'))
+    assert large_bytes > RECV_BUFFER_SIZE
+    t0 = time.perf_counter()
+    feed(messages, itertools.repeat(LARGE_CHUNK))
+    large = time.perf_counter() - t0
+
+    return {
+        'small_messages': count,
+        'small_seconds': small,
+        'large_bytes': large_bytes,
+        'large_seconds': large,
+        'large_mb_per_second': large_bytes / large / 1e6,
+    }
+
+
+def main():
+    result = bench_framing()
+    print('{} messages in chunks of {} bytes: {:.2f} ms'.format(
+        result['small_messages'], '/'.join(map(str, SMALL_CHUNKS)),
+        result['small_seconds'] * 1e3))
+    print('{} byte frame in chunks of {} bytes: {:.2f} ms, {:.0f} MB/s'.format(
+        result['large_bytes'], LARGE_CHUNK, result['large_seconds'] * 1e3,
+        result['large_mb_per_second']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Measure connect time and request/reply round-trip latency against the
+fake server.
+
+Usage:
+    python -m benchmarks.latency [count]
+"""
+
+import statistics
+import sys
+import time
+
+from pydevc.client import PyDevClient
+
+from .fake_pydevd import FakePyDevServer
+
+
+def summarize(samples, unit='us'):
+    """Mean and percentiles of latency samples given in seconds."""
+    scale = {'us': 1e6, 'ms': 1e3}[unit]
+    samples = sorted(samples)
+    return {
+        'samples': len(samples),
+        'mean_' + unit: statistics.mean(samples) * scale,
+        'p50_' + unit: samples[len(samples) // 2] * scale,
+        'p99_' + unit: samples[int(len(samples) * 0.99)] * scale,
+    }
+
+
+def bench_connect(count=200):
+    """Time count connections until the server has accepted them."""
+    samples = []
+    for _ in range(count):
+        server = FakePyDevServer()
+        server.start()
+
+        client = PyDevClient(server.host, server.port)
+        t0 = time.perf_counter()
+        client.connect()
+        server.connected.wait()
+        samples.append(time.perf_counter() - t0)
+
+        client.writer.close()
+        client.conn.close()
+        server.close()
+    return summarize(samples)
+
+
+def bench_latency(count=2000):
+    """Time count sequential init requests."""
+    server = FakePyDevServer()
+    server.start()
+
+    client = PyDevClient(server.host, server.port)
+    client.connect()
+    client.start()
+
+    samples = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        client.init('1.0')
+        samples.append(time.perf_counter() - t0)
+    server.close()
+    return summarize(samples)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    result = bench_connect(max(1, count // 10))
+    print('{samples} connects: mean {mean_us:.0f} us, p50 {p50_us:.0f} us, '
+          'p99 {p99_us:.0f} us'.format(**result))
+    result = bench_latency(count)
+    print('{samples} round trips: mean {mean_us:.0f} us, p50 {p50_us:.0f} us, '
+          'p99 {p99_us:.0f} us'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Measure parse time and peak memory of large suspend and frame payloads.
+
+Compares the streaming parser against parsing the whole document with
+ElementTree after unquoting it.
+
+Usage:
+    python -m benchmarks.parsing
+"""
+
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from pydevc.xmlstream import iter_threads, iter_variables, unquote
+
+from .fake_pydevd import CMD_SET_BREAK, frame_payload, suspend_payload
+
+
+def deep_stack(depth=200):
+    """Frames of a stack of the given depth, innermost first."""
+    return [(i, 'function_{}'.format(i), '/srv/app/module_{}.py'.format(i),
+             i + 1) for i in range(depth)]
+
+
+def legacy_suspend(payload):
+    for thread in ET.fromstring(payload):
+        frames = [f.attrib['id'] for f in thread]
+        return frames, unquote(unquote(thread[0].attrib['file']))
+
+
+def stream_suspend(payload):
+    for _thread, frames in iter_threads(payload):
+        return [f['id'] for f in frames], frames[0]['file']
+
+
+def legacy_frame(payload):
+    return {unquote(var.attrib['name']): unquote(var.attrib['value'])[:80]
+            for var in ET.fromstring(unquote(payload))}
+
+
+def stream_frame(payload):
+    return {var['name']: var['value'][:80] for var in iter_variables(payload)}
+
+
+def measure(func, payload, repeat=5):
+    """Return the best time and the peak memory of func(payload)."""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(payload)
+        best = min(best, time.perf_counter() - t0)
+
+    tracemalloc.start()
+    func(payload)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+
+def bench_parsing():
+    suspend = suspend_payload('pid_1_id_1', deep_stack(), CMD_SET_BREAK)
+    frame = frame_payload()
+    assert legacy_suspend(suspend) == stream_suspend(suspend)
+    assert legacy_frame(frame) == stream_frame(frame)
+
+    return {
+        'suspend_bytes': len(suspend),
+        'frame_bytes': len(frame),
+        'suspend_legacy': measure(legacy_suspend, suspend),
+        'suspend_stream': measure(stream_suspend, suspend),
+        'frame_legacy': measure(legacy_frame, frame),
+        'frame_stream': measure(stream_frame, frame),
+    }
+
+
+def main():
+    result = bench_parsing()
+    for key in ('suspend_legacy', 'suspend_stream', 'frame_legacy',
+                'frame_stream'):
+        print('{:<16} {:8.2f} ms {:10.0f} KiB peak'.format(
+            key, result[key]['seconds'] * 1e3,
+            result[key]['peak_bytes'] / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Measure the latency of stepping from the REPL, from the command to the new
+position printed.
+
+Usage:
+    python -m benchmarks.repl [count]
+"""
+
+import io
+import sys
+import threading
+import time
+
+from pydevc.client import PyDevClient
+from pydevc.repl import DebuggerConsole
+
+from .fake_pydevd import (
+    FakePyDevServer,
+    CMD_STEP_OVER,
+    CMD_THREAD_SUSPEND,
+    suspend_payload,
+)
+from .latency import summarize
+
+
+def bench_step(count=500):
+    """Time count next commands against a server that stops the thread on the
+    following line right away."""
+    server = FakePyDevServer()
+    line = [1]
+
+    def _suspend(thread_id):
+        server.send_event(CMD_THREAD_SUSPEND, suspend_payload(
+            thread_id, [(line[0], 'main', '/srv/app/main.py', line[0])]))
+        line[0] += 1
+
+    server.handlers[CMD_STEP_OVER] = lambda args: _suspend(args[0])
+    server.start()
+
+    stdout = io.StringIO()
+    console = DebuggerConsole(server.host, server.port, stdout=stdout)
+    console.preloop()
+
+    suspended = threading.Event()
+    on_suspend = console.session.callbacks[PyDevClient.EVENT_THREAD_SUSPEND]
+
+    def _on_suspend(*args):
+        on_suspend(*args)
+        suspended.set()
+
+    console.session.callbacks[PyDevClient.EVENT_THREAD_SUSPEND] = _on_suspend
+    _suspend('pid_1_id_1')
+    suspended.wait(timeout=10)
+
+    samples = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        console.onecmd('next')
+        samples.append(time.perf_counter() - t0)
+        stdout.seek(0)
+        stdout.truncate()
+    server.close()
+
+    result = summarize(samples)
+    result.update(steps=count, reached_line=line[0] - 1)
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    result = bench_step(count)
+    print('{steps} steps: mean {mean_us:.0f} us, p50 {p50_us:.0f} us, '
+          'p99 {p99_us:.0f} us'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Run all benchmarks and report the results as JSON.
+
+Every benchmark has one key metric, and a previous report can be given as a
+baseline: the run fails if a key metric got worse by more than the
+tolerance, so regressions in the hot paths show up before a release.
+
+Usage:
+    python -m benchmarks [--output FILE] [--baseline FILE]
+                         [--tolerance FRACTION] [--quick] [name ...]
+"""
+
+import argparse
+import collections
+import json
+import platform
+import sys
+import time
+
+from .breakpoints import bench_breakpoints
+from .dispatch import bench_dispatch, bench_suspend
+from .framing import bench_framing
+from .latency import bench_connect, bench_latency
+from .parsing import bench_parsing
+from .repl import bench_step
+from .variables import bench_locals
+
+Benchmark = collections.namedtuple(
+    'Benchmark', ['run', 'quick', 'metric', 'higher_is_better'])
+
+# Benchmarks by name, with arguments for a quick run and the key metric as a
+# dotted path into the result.
+BENCHMARKS = collections.OrderedDict([
+    ('connect', Benchmark(bench_connect, {'count': 20},
+                          'p50_us', False)),
+    ('init', Benchmark(bench_latency, {'count': 200},
+                       'p50_us', False)),
+    ('breakpoints', Benchmark(bench_breakpoints, {'count': 500},
+                              'batch_per_second', True)),
+    ('dispatch', Benchmark(bench_dispatch, {'count': 2000},
+                           'messages_per_second', True)),
+    ('suspend', Benchmark(bench_suspend, {'count': 1000},
+                          'messages_per_second', True)),
+    ('locals', Benchmark(bench_locals, {'repeat': 3},
+                         'p50_ms', False)),
+    ('framing', Benchmark(bench_framing, {'count': 200,
+                                          'size': 1024 * 1024},
+                          'large_seconds', False)),
+    ('parsing', Benchmark(bench_parsing, {},
+                          'frame_stream.seconds', False)),
+    ('repl_step', Benchmark(bench_step, {'count': 50},
+                            'p50_us', False)),
+])
+
+# Allowed slowdown of a key metric compared to the baseline.
+TOLERANCE = 0.25
+
+
+def metric(result, path):
+    """Get the value at a dotted path of a result."""
+    for key in path.split('.'):
+        result = result[key]
+    return result
+
+
+def run_suite(names=None, quick=False):
+    """Run the named benchmarks, or all of them, returns the report."""
+    results = collections.OrderedDict()
+    for name in names or BENCHMARKS:
+        benchmark = BENCHMARKS[name]
+        t0 = time.perf_counter()
+        result = benchmark.run(**(benchmark.quick if quick else {}))
+        result['metric'] = benchmark.metric
+        result['value'] = metric(result, benchmark.metric)
+        result['elapsed'] = time.perf_counter() - t0
+        results[name] = result
+
+    return {
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': quick,
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """Find the key metrics that got worse than the baseline by more than
+    the tolerance, returns a list of dicts."""
+    regressions = []
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None or previous.get('metric') != result['metric']:
+            continue
+        old, new = previous['value'], result['value']
+        if not old or not new:
+            continue
+        if BENCHMARKS[name].higher_is_better:
+            change = old / new - 1
+        else:
+            change = new / old - 1
+        if change > tolerance:
+            regressions.append({'benchmark': name, 'metric': result['metric'],
+                                'baseline': old, 'value': new,
+                                'slowdown': change})
+    return regressions
+
+
+def parse_options(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument(
+        'names',
+        nargs='*',
+        metavar='name',
+        help='benchmarks to run, all by default: {}'.format(
+            ', '.join(BENCHMARKS))
+    )
+    parser.add_argument(
+        '--output',
+        action='store',
+        metavar='FILE',
+        help='write the report to FILE instead of stdout'
+    )
+    parser.add_argument(
+        '--baseline',
+        action='store',
+        metavar='FILE',
+        help='compare against an earlier report, exit with 1 on regressions'
+    )
+    parser.add_argument(
+        '--tolerance',
+        action='store',
+        type=float,
+        default=TOLERANCE,
+        metavar='FRACTION',
+        help='allowed slowdown compared to the baseline, defaults to {}'
+        .format(TOLERANCE)
+    )
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        help='use small inputs, to check that the benchmarks work'
+    )
+
+    options = parser.parse_args(argv)
+    unknown = [name for name in options.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmark: {}'.format(', '.join(unknown)))
+    return options
+
+
+def main(argv=None):
+    options = parse_options(sys.argv[1:] if argv is None else argv)
+    report = run_suite(options.names, quick=options.quick)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            report['regressions'] = compare(report, json.load(f),
+                                            options.tolerance)
+
+    text = json.dumps(report, indent=2) + '\n'
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+    for regression in report.get('regressions', []):
+        sys.stderr.write(
+            '{benchmark}: {metric} {baseline:.6g} -> {value:.6g} '
+            '({slowdown:.0%} worse)\n'.format(**regression))
+    return 1 if report.get('regressions') else 0
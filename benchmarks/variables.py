@@ -0,0 +1,78 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Measure get_locals on frames with many local variables.
+
+Usage:
+    python -m benchmarks.variables [variables]
+"""
+
+import sys
+import threading
+import time
+
+from pydevc.client import PyDevClient
+
+from .fake_pydevd import (
+    FakePyDevServer,
+    CMD_GET_FRAME,
+    CMD_THREAD_SUSPEND,
+    frame_payload,
+    suspend_payload,
+)
+from .latency import summarize
+
+
+def bench_locals(count=5000, repeat=20):
+    """Time get_locals on a frame of count variables, in a new stop every
+    time so that nothing is served from the variable cache."""
+    payload = frame_payload(count)
+    server = FakePyDevServer({CMD_GET_FRAME: lambda args: payload})
+    server.start()
+
+    client = PyDevClient(server.host, server.port)
+    client.connect()
+    suspended = threading.Event()
+    client.callbacks[PyDevClient.EVENT_THREAD_SUSPEND] = \
+        lambda *args: suspended.set()
+    client.start()
+    client.init('1.0')
+
+    samples = []
+    for i in range(repeat):
+        suspended.clear()
+        server.send_event(CMD_THREAD_SUSPEND, suspend_payload(
+            'pid_1_id_1', [(i, 'main', '/srv/app/main.py', 1)]))
+        suspended.wait(timeout=10)
+
+        t0 = time.perf_counter()
+        frame_locals = client.get_locals()
+        samples.append(time.perf_counter() - t0)
+        assert len(frame_locals) == count
+    server.close()
+
+    result = summarize(samples, unit='ms')
+    result.update(variables=count, payload_bytes=len(payload))
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    result = bench_locals(count)
+    print('get_locals of {variables} variables ({payload_bytes} bytes): '
+          'mean {mean_ms:.1f} ms, p50 {p50_ms:.1f} ms, p99 {p99_ms:.1f} ms'
+          .format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -40,7 +40,7 @@ def main():
 
     root.addHandler(console)
 
-    run_repl(options)
+    sys.exit(run_repl(options))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,601 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Implements an asyncio-native client for PyDev debugger.
+
+AsyncPyDevClient speaks the same protocol as PyDevClient, but runs entirely on
+an asyncio event loop: replies are awaited and spontaneous events are delivered
+through an async event stream instead of callbacks, so one process can drive
+many debug sessions without a thread per session.
+"""
+
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import signal
+import time
+
+from _pydevd_bundle.pydevd_comm import (
+    CMD_RUN,
+    CMD_VERSION,
+    CMD_THREAD_CREATE,
+    CMD_THREAD_SUSPEND,
+    CMD_THREAD_KILL,
+    CMD_THREAD_RUN,
+    CMD_STEP_OVER,
+    CMD_STEP_INTO,
+    CMD_STEP_RETURN,
+    CMD_SMART_STEP_INTO,
+    CMD_LIST_THREADS,
+    CMD_EVALUATE_EXPRESSION,
+    CMD_GET_FRAME,
+    CMD_WRITE_TO_CONSOLE
+)
+
+from .client import PyDevClient, find_first_statement
+from .breakpoints import BreakpointRegistry
+from .logpoints import LogpointStream, iter_log_messages
+from .protocol import (
+    decode_message,
+    encode_message,
+    is_reply,
+    new_breakpoint,
+    parse_pid,
+    parse_suspend,
+    parse_threads,
+    parse_value,
+    parse_version,
+    remove_break_command,
+    temporary_breakpoint_hit,
+    update_breakpoint,
+)
+from .stats import Metrics, command_name
+from .threads import ThreadTable
+from .trace import TraceRecorder
+from .xmlstream import iter_variables
+
+
+# Largest single message accepted from the server. Suspend events with deep
+# stacks and frames with big locals are sent as one line.
+STREAM_LIMIT = 64 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPyDevClient:
+    """Asyncio counterpart of PyDevClient.
+
+    Events are the same as with PyDevClient, and are delivered as tuples of
+    the event name followed by the arguments a callback would receive:
+
+        async for event, *args in client.events():
+            if event == AsyncPyDevClient.EVENT_THREAD_SUSPEND:
+                filename, line_no, function = args
+    """
+
+    EVENT_THREAD_CREATE = PyDevClient.EVENT_THREAD_CREATE
+    EVENT_THREAD_KILL = PyDevClient.EVENT_THREAD_KILL
+    EVENT_THREAD_SUSPEND = PyDevClient.EVENT_THREAD_SUSPEND
+    EVENT_SET_BREAKPOINT = PyDevClient.EVENT_SET_BREAKPOINT
+    EVENT_REMOVE_BREAKPOINT = PyDevClient.EVENT_REMOVE_BREAKPOINT
+    EVENT_SET_BREAKPOINTS = PyDevClient.EVENT_SET_BREAKPOINTS
+    EVENT_REMOVE_BREAKPOINTS = PyDevClient.EVENT_REMOVE_BREAKPOINTS
+    EVENT_SERVER_EXIT = PyDevClient.EVENT_SERVER_EXIT
+    EVENT_WATCHES = PyDevClient.EVENT_WATCHES
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.msg_id = 1
+        self.pid = None
+
+        self.reader = None
+        self.writer = None
+        self._reader_task = None
+        self._closed = False
+
+        # Requests waiting for a reply, keyed by message id.
+        self.pending_replies = {}
+
+        # Counters and latencies of the connection, see PyDevClient.
+        self.metrics = Metrics()
+        self._request_times = {}
+        self.bytes_sent = self.messages_sent = 0
+        self.bytes_received = self.messages_received = 0
+
+        self.breakpoints = BreakpointRegistry()
+        self.threads = ThreadTable()
+
+        self._events = asyncio.Queue()
+
+        # Futures resolved with the position of the next suspend, per thread.
+        self._suspend_waiters = {}
+
+        # Values of evaluated expressions by (thread id, frame id), kept
+        # until the thread moves on, and watch expressions by id.
+        self._evaluations = {}
+        self.watches = collections.OrderedDict()
+        self._watch_ids = itertools.count(1)
+
+        # Output of logpoints, the sinks run in the event loop.
+        self.logpoints = LogpointStream()
+
+        # Records the traffic to a file when set, see start_trace.
+        self.trace = None
+
+    async def connect(self, timeout=5):
+        """Connect to the remote debugger and start reading messages."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                self.reader, self.writer = await asyncio.open_connection(
+                    self.host, self.port, limit=STREAM_LIMIT)
+                break
+            except OSError:
+                if loop.time() > deadline:
+                    raise TimeoutError('Connection timed out') from None
+                await asyncio.sleep(0.1)
+
+        self.logpoints.start(loop)
+        self._reader_task = loop.create_task(self.__read())
+
+    def start_trace(self, path):
+        """Record all messages to a trace file, see PyDevClient.start_trace.
+        """
+        self.stop_trace()
+        self.trace = TraceRecorder(path, host=self.host, port=self.port)
+
+    def stop_trace(self):
+        """Stop recording messages and close the trace file."""
+        trace, self.trace = self.trace, None
+        if trace is not None:
+            trace.close()
+
+    async def close(self):
+        """Close the connection to the remote debugger."""
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+        if self._reader_task is not None:
+            await self._reader_task
+
+    async def events(self):
+        """Iterate over events until the server exits."""
+        while True:
+            event = await self._events.get()
+            yield event
+            if event[0] == AsyncPyDevClient.EVENT_SERVER_EXIT:
+                return
+
+    def __emit(self, key, *args):
+        self._events.put_nowait((key,) + args)
+
+    def __send(self, *args, expect_reply=False):
+        return self.__send_batch([args], expect_reply=expect_reply)[0]
+
+    def __send_batch(self, commands, expect_reply=False):
+        """Queue many messages with a single write, returns their ids."""
+        if self._closed:
+            # Nothing would resolve the replies after the reader has exited.
+            raise ConnectionError('Connection to server closed')
+        ids, data = [], []
+        sent_at = time.perf_counter()
+        for args in commands:
+            _id = self.msg_id
+            self.msg_id += 2
+            msg = encode_message(_id, *args)
+
+            name = command_name(args[0])
+            if expect_reply:
+                self.pending_replies[_id] = \
+                    asyncio.get_running_loop().create_future()
+                self._request_times[_id] = (name, sent_at)
+
+            self.metrics.count('sent.' + name)
+            logger.debug('>>> %s', msg)
+            ids.append(_id)
+            data.append(msg)
+
+        if self.trace is not None:
+            self.trace.sent(data)
+        data = ''.join(data).encode('utf-8')
+        self.writer.write(data)
+        self.bytes_sent += len(data)
+        self.messages_sent += len(ids)
+        return ids
+
+    async def __request(self, *args, timeout=5):
+        """Send a message and wait for the reply to it."""
+        msg_id = self.__send(*args, expect_reply=True)
+        future = self.pending_replies[msg_id]
+        try:
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.metrics.count('timeout')
+            raise TimeoutError('No reply from server received') from None
+        finally:
+            # Forget the request, a late reply will be dropped.
+            self.pending_replies.pop(msg_id, None)
+            self._request_times.pop(msg_id, None)
+
+    async def __read(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line.endswith(b'\n'):
+                    break
+                self.bytes_received += len(line)
+                self.messages_received += 1
+                self.__process(line[:-1].decode('utf-8'))
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            logger.exception('Reading from server failed')
+        finally:
+            logger.debug('server closed the socket')
+            self._closed = True
+            for future in self.pending_replies.values():
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError('Connection to server closed'))
+            self.pending_replies.clear()
+            closed = ConnectionError('Connection to server closed')
+            for thread_id in list(self._suspend_waiters):
+                self.__wake_suspend_waiters(thread_id, exception=closed)
+            self.logpoints.close()
+            self.stop_trace()
+            self.__emit(AsyncPyDevClient.EVENT_SERVER_EXIT)
+
+    def __process(self, message):
+        logger.debug('<<< %s', message)
+        if self.trace is not None:
+            self.trace.received(message)
+        cmd, msg_id, args = decode_message(message)
+
+        if is_reply(msg_id):
+            # A reply to a message from us, wake up whoever is waiting for it.
+            future = self.pending_replies.get(msg_id)
+            request = self._request_times.pop(msg_id, None)
+            if request is not None:
+                self.metrics.observe('rtt.' + request[0],
+                                     time.perf_counter() - request[1])
+            if future is None:
+                logger.debug('Dropping unexpected reply %s', msg_id)
+            elif not future.done():
+                future.set_result(args)
+        elif cmd == CMD_WRITE_TO_CONSOLE:
+            for breakpoint_id, text in iter_log_messages(args[0]):
+                self.logpoints.push(breakpoint_id, text)
+        else:
+            try:
+                with self.metrics.timed('event.' + command_name(cmd)):
+                    self.__event(cmd, args)
+            except Exception:  # pylint: disable=locally-disabled, broad-except
+                logger.exception('Failed to handle event %s', cmd)
+
+    def __event(self, cmd, args):
+        if cmd == CMD_THREAD_CREATE:
+            for thread_id, name in parse_threads(args[0]):
+                thread = self.threads.create(thread_id, name)
+                self.__emit(AsyncPyDevClient.EVENT_THREAD_CREATE,
+                            thread.id, thread.name)
+
+        if cmd == CMD_THREAD_KILL:
+            thread_id = args[0]
+            thread = self.threads.kill(thread_id)
+            if thread is None:
+                logger.debug('Killed nonexistent thread: %s', thread_id)
+                return
+            self.__forget_evaluations(thread_id)
+            self.__wake_suspend_waiters(thread_id, exception=RuntimeError(
+                'Thread exited: {}'.format(thread_id)))
+            self.__emit(AsyncPyDevClient.EVENT_THREAD_KILL,
+                        thread_id, thread.name)
+
+        if cmd == CMD_THREAD_SUSPEND:
+            with self.metrics.timed('parse.CMD_THREAD_SUSPEND'):
+                suspended = parse_suspend(args[0])
+
+            for thread_id, stop_reason, frames in suspended:
+                temporary = temporary_breakpoint_hit(self.breakpoints,
+                                                     stop_reason, frames[0])
+                if temporary is not None:
+                    self.__remove_breakpoint(temporary['id'])
+
+                self.__forget_evaluations(thread_id)
+                self.threads.suspend(thread_id, frames, stop_reason)
+                position = frames[0].position
+                self.__wake_suspend_waiters(thread_id, position=position)
+                self.__emit(AsyncPyDevClient.EVENT_THREAD_SUSPEND, *position)
+
+                if self.watches:
+                    asyncio.get_running_loop().create_task(
+                        self.__refresh_watches(thread_id, frames[0].id))
+
+    def __wake_suspend_waiters(self, thread_id, position=None, exception=None):
+        for future in self._suspend_waiters.pop(thread_id, []):
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(position)
+
+    async def init(self, version,
+                   os_type=('WINDOWS' if os.name == 'nt' else 'UNIX'),
+                   breakpoint_method='ID'):
+        """Initialize debugger, see PyDevClient.init."""
+        server_version = parse_version(await self.__request(
+            CMD_VERSION, version, os_type, breakpoint_method))
+        logger.debug('pydevd version: %s', server_version)
+        return server_version
+
+    async def add_breakpoint(self, filename='', line_number='', function=None,
+                             condition=None, expression=None, hit_count=None,
+                             ignore_count=None, log_message=None,
+                             _temporary=False):
+        """Set a breakpoint into the debugged program.
+        """
+        breakpoint, command = new_breakpoint(
+            self.breakpoints, filename, line_number, function, condition,
+            expression, hit_count, ignore_count, log_message, _temporary)
+        self.__send(*command)
+        await self.writer.drain()
+
+        self.__emit(AsyncPyDevClient.EVENT_SET_BREAKPOINT, breakpoint)
+        return breakpoint['id']
+
+    async def add_breakpoints(self, breakpoints):
+        """Set many breakpoints at once, see PyDevClient.add_breakpoints."""
+        added, commands = [], []
+        for kwargs in breakpoints:
+            breakpoint, command = new_breakpoint(self.breakpoints, **kwargs)
+            added.append(breakpoint)
+            commands.append(command)
+
+        if commands:
+            self.__send_batch(commands)
+            await self.writer.drain()
+        self.__emit(AsyncPyDevClient.EVENT_SET_BREAKPOINTS, added)
+        return [bp['id'] for bp in added]
+
+    def __remove_breakpoint(self, breakpoint_id):
+        bp = self.breakpoints.remove(breakpoint_id)
+        self.__send(*remove_break_command(bp))
+        self.__emit(AsyncPyDevClient.EVENT_REMOVE_BREAKPOINT, bp)
+
+    async def remove_breakpoint(self, breakpoint_id):
+        """Remove a breakpoint from the debugged program.
+        """
+        self.__remove_breakpoint(breakpoint_id)
+        await self.writer.drain()
+
+    async def remove_breakpoints(self, breakpoint_ids):
+        """Remove many breakpoints at once, see
+        PyDevClient.remove_breakpoints."""
+        removed = [self.breakpoints.remove(i) for i in breakpoint_ids]
+        if removed:
+            self.__send_batch([remove_break_command(bp) for bp in removed])
+            await self.writer.drain()
+        self.__emit(AsyncPyDevClient.EVENT_REMOVE_BREAKPOINTS, removed)
+
+    async def update_breakpoint(self, breakpoint_id, **changes):
+        """Change a breakpoint, see PyDevClient.update_breakpoint."""
+        bp, command = update_breakpoint(self.breakpoints, breakpoint_id,
+                                        changes)
+        self.__send(*command)
+        await self.writer.drain()
+        self.__emit(AsyncPyDevClient.EVENT_SET_BREAKPOINT, bp)
+
+    async def start_debugger(self, filename=None, line_number=None):
+        """Start the debugger, see PyDevClient.start_debugger."""
+        if filename:
+            if not line_number:
+                line_number = find_first_statement(filename)
+            await self.add_breakpoint(filename=filename,
+                                      line_number=line_number,
+                                      _temporary=True)
+
+        threads, = await self.__request(CMD_LIST_THREADS)
+
+        # Figure out the PID of the project
+        self.pid = parse_pid(threads)
+
+        self.__send(CMD_RUN)
+        await self.writer.drain()
+
+    def kill_debugger(self):
+        """Kill the debugger, see PyDevClient.kill_debugger."""
+        if self.pid is None:
+            raise RuntimeError('Debugger not yet running')
+
+        os.kill(self.pid, signal.SIGTERM)
+
+    async def thread_info(self):
+        """Get information on the threads of the debugged process. """
+        threads, = await self.__request(CMD_LIST_THREADS)
+        for thread_id, name in parse_threads(threads, internal=False):
+            self.threads.create(thread_id, name)
+        return self.threads
+
+    def select_thread(self, thread):
+        """Make a thread, given by id or name, the active one."""
+        return self.threads.select(thread)
+
+    def select_frame(self, thread=None, index=0):
+        """Select a frame, see PyDevClient.select_frame."""
+        return self.threads[self.threads.resolve(thread)].select_frame(index)
+
+    def frame_up(self, thread=None, count=1):
+        """Select a frame further out, see PyDevClient.frame_up."""
+        thread = self.threads[self.threads.resolve(thread)]
+        return thread.select_frame(thread.selected + count)
+
+    def frame_down(self, thread=None, count=1):
+        """Select a frame further in, see PyDevClient.frame_down."""
+        thread = self.threads[self.threads.resolve(thread)]
+        return thread.select_frame(thread.selected - count)
+
+    async def __progress_thread(self, cmd, thread, wait=False, timeout=None):
+        """Let a suspended thread run.
+
+        With wait, return the new position of the thread once it stops again.
+        Raises TimeoutError if that takes longer than timeout seconds.
+        """
+        thread_id = self.threads.resolve(thread)
+        self.__forget_evaluations(thread_id)
+        self.threads.resume(thread_id)
+        self.__send(cmd, thread_id)
+
+        # Registered before yielding, the suspend may be read on the next
+        # turn.
+        if wait:
+            suspended = asyncio.get_running_loop().create_future()
+            self._suspend_waiters.setdefault(thread_id, []).append(suspended)
+        await self.writer.drain()
+
+        if not wait:
+            return None
+        try:
+            return await asyncio.wait_for(suspended, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('Thread did not stop in time') from None
+
+    def get_position(self, thread=None):
+        """Get the position of a suspended thread."""
+        return self.threads[self.threads.resolve(thread)].position
+
+    async def step_over(self, thread=None, wait=False, timeout=None):
+        return await self.__progress_thread(CMD_STEP_OVER, thread, wait,
+                                            timeout)
+
+    async def step_into(self, thread=None, my_code=False, wait=False,
+                        timeout=None):
+        return await self.__progress_thread(
+            CMD_SMART_STEP_INTO if my_code else CMD_STEP_INTO, thread, wait,
+            timeout)
+
+    async def step_return(self, thread=None, wait=False, timeout=None):
+        return await self.__progress_thread(CMD_STEP_RETURN, thread, wait,
+                                            timeout)
+
+    async def continue_thread(self, thread=None, wait=False, timeout=None):
+        return await self.__progress_thread(CMD_THREAD_RUN, thread, wait,
+                                            timeout)
+
+    async def evaluate(self, expression, cache=True):
+        """Evaluate expression in the selected frame of the active thread,
+        see PyDevClient.evaluate."""
+        thread, frame = self.threads.active_frame()
+        if not cache:
+            return await self.__evaluate(thread.id, frame.id, expression)
+        values, = await self.__evaluate_many(thread.id, frame.id, [expression])
+        return values
+
+    async def __evaluate(self, thread_id, frame_id, expression):
+        reply = await self.__request(
+            CMD_EVALUATE_EXPRESSION, thread_id, frame_id, None, expression, 1,
+            timeout=10)
+        with self.metrics.timed('parse.CMD_EVALUATE_EXPRESSION'):
+            return parse_value(reply[0])
+
+    async def __evaluate_many(self, thread_id, frame_id, expressions):
+        """Get the values of expressions, the ones not evaluated in this stop
+        yet are requested all at once."""
+        cached = self._evaluations.setdefault((thread_id, frame_id), {})
+        missing = [e for e in dict.fromkeys(expressions) if e not in cached]
+        if missing:
+            values = await asyncio.gather(*[
+                self.__evaluate(thread_id, frame_id, e) for e in missing])
+            cached.update(zip(missing, values))
+        return [cached[e] for e in expressions]
+
+    def __forget_evaluations(self, thread_id):
+        for key in [k for k in self._evaluations if k[0] == thread_id]:
+            del self._evaluations[key]
+
+    def add_watch(self, expression):
+        """Watch an expression, see PyDevClient.add_watch."""
+        watch_id = next(self._watch_ids)
+        self.watches[watch_id] = expression
+        return watch_id
+
+    def remove_watch(self, watch_id):
+        """Stop watching an expression."""
+        try:
+            del self.watches[watch_id]
+        except KeyError:
+            raise RuntimeError('No watch number {}'.format(watch_id)) from None
+
+    async def evaluate_watches(self):
+        """Values of the watches, see PyDevClient.evaluate_watches."""
+        thread, frame = self.threads.active_frame()
+        return await self.__evaluate_watches(thread.id, frame.id)
+
+    async def __evaluate_watches(self, thread_id, frame_id):
+        watches = list(self.watches.items())
+        values = await self.__evaluate_many(
+            thread_id, frame_id, [expression for _, expression in watches])
+        return [(watch_id, expression, value)
+                for (watch_id, expression), value in zip(watches, values)]
+
+    async def __refresh_watches(self, thread_id, frame_id):
+        thread = self.threads.get(thread_id)
+        if thread is None or not thread.frames or \
+                thread.frames[0].id != frame_id:
+            return
+        try:
+            results = await self.__evaluate_watches(thread_id, frame_id)
+        except (TimeoutError, ConnectionError) as e:
+            logger.debug('Evaluating watches failed: %s', e)
+            return
+        self.__emit(AsyncPyDevClient.EVENT_WATCHES, thread_id, frame_id,
+                    results)
+
+    async def get_locals(self):
+        """Get values of local variables """
+        thread, frame = self.threads.active_frame()
+        reply = await self.__request(CMD_GET_FRAME, thread.id, frame.id, None,
+                                     timeout=10)
+
+        with self.metrics.timed('parse.CMD_GET_FRAME'):
+            return {
+                var['name']: {
+                    'type': var['type'],
+                    'value': var['value'],
+                    'qualifier': var['qualifier'],
+                    'container': var.get('isContainer', '') == 'True',
+                } for var in iter_variables(reply[0])
+            }
+
+    def get_stats(self):
+        """Counters and latencies of the connection, see
+        PyDevClient.get_stats."""
+        threads = self.threads.values()
+        return self.metrics.snapshot(
+            threads=len(threads),
+            suspended_threads=sum(1 for t in threads if t.suspended),
+            pending_replies=len(self.pending_replies),
+            event_backlog=self._events.qsize(),
+            bytes_sent=self.bytes_sent,
+            messages_sent=self.messages_sent,
+            bytes_received=self.bytes_received,
+            messages_received=self.messages_received,
+            logpoints=self.logpoints.stats(),
+        )
+
+    def reset_stats(self):
+        """Start measuring counters and latencies from zero."""
+        self.metrics.reset()
@@ -0,0 +1,144 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Bookkeeping of the breakpoints set to the debugger."""
+
+import collections.abc
+import heapq
+import threading
+import uuid
+
+from .logpoints import log_condition
+
+# Hit counters live in the debuggee, in a dict kept in its builtins so that
+# every frame can reach it.
+HIT_COUNTER = ("__import__('builtins').__dict__"
+               ".setdefault('_pydevc_hit_counts', {})")
+
+
+class BreakpointRegistry(collections.abc.Mapping):
+    """Breakpoints by id, indexed by location.
+
+    Ids are handed out lowest free id first: released ids are kept in a heap
+    and reused before new ones are taken, so allocation is O(log n) and there
+    is no upper limit on the number of breakpoints.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._breakpoints = {}
+        self._locations = collections.defaultdict(dict)
+        self._free_ids = []
+        self._next_id = 0
+
+    def __getitem__(self, breakpoint_id):
+        return self._breakpoints[breakpoint_id]
+
+    def __iter__(self):
+        return iter(list(self._breakpoints))
+
+    def __len__(self):
+        return len(self._breakpoints)
+
+    @staticmethod
+    def _location(filename, line):
+        # Lines arrive from the server as strings.
+        return filename, str(line)
+
+    def allocate(self):
+        """Reserve an id for a new breakpoint."""
+        with self.lock:
+            if self._free_ids:
+                return heapq.heappop(self._free_ids)
+            breakpoint_id = self._next_id
+            self._next_id += 1
+            return breakpoint_id
+
+    def release(self, breakpoint_id):
+        """Return an id that was allocated but never used."""
+        with self.lock:
+            heapq.heappush(self._free_ids, breakpoint_id)
+
+    def add(self, breakpoint):
+        """Register a breakpoint under its allocated id."""
+        location = self._location(breakpoint['filename'], breakpoint['line'])
+        with self.lock:
+            self._breakpoints[breakpoint['id']] = breakpoint
+            self._locations[location][breakpoint['id']] = breakpoint
+
+    def remove(self, breakpoint_id):
+        """Forget a breakpoint and free its id, returns the breakpoint."""
+        with self.lock:
+            breakpoint = self._breakpoints.pop(breakpoint_id)
+            location = self._location(breakpoint['filename'],
+                                      breakpoint['line'])
+            at_location = self._locations[location]
+            del at_location[breakpoint_id]
+            if not at_location:
+                del self._locations[location]
+            heapq.heappush(self._free_ids, breakpoint_id)
+        return breakpoint
+
+    def at(self, filename, line):
+        """Get the breakpoints set at a location."""
+        with self.lock:
+            return list(self._locations
+                        .get(self._location(filename, line), {}).values())
+
+
+def hit_condition(condition=None, hit_count=None, ignore_count=None):
+    """Build the condition pydevd evaluates when a breakpoint is reached.
+
+    Hits are counted inside the debuggee, so only the stops that pass the
+    filter are reported to the client. A hit is a pass where the condition
+    holds. The first ignore_count hits are skipped, and with hit_count the
+    breakpoint stops on that hit only. Every call uses a new counter, so
+    counting starts over whenever the breakpoint is set.
+    """
+    if not hit_count and not ignore_count:
+        return condition
+
+    stop = ['n > {:d}'.format(ignore_count or 0)]
+    if hit_count:
+        stop.append('n == {:d}'.format(hit_count))
+    counted = ('(lambda n: {})((lambda h, k: h.__setitem__(k, h.get(k, 0) + 1)'
+               ' or h[k])({}, {!r}))'.format(' and '.join(stop), HIT_COUNTER,
+                                            uuid.uuid4().hex))
+    if condition:
+        return '({}) and {}'.format(condition, counted)
+    return counted
+
+
+def set_break_args(breakpoint):
+    """Arguments of CMD_SET_BREAK after the id for a breakpoint.
+
+    The condition of a logpoint logs its message once the breakpoint's own
+    condition and counts have passed.
+    """
+    condition = hit_condition(breakpoint['condition'],
+                              breakpoint.get('hit_count'),
+                              breakpoint.get('ignore_count'))
+    if breakpoint.get('log_message') is not None:
+        log = log_condition(breakpoint['id'], breakpoint['log_message'])
+        condition = '({}) and {}'.format(condition, log) if condition else log
+    return ('python-line', breakpoint['filename'], breakpoint['line'],
+            breakpoint['function'], _escape(condition),
+            _escape(breakpoint['expression']))
+
+
+def _escape(expression):
+    """Escape an expression for the tab separated wire format."""
+    if expression is None:
+        return None
+    return (expression.replace('\n', '@_@NEW_LINE_CHAR@_@')
+            .replace('\t', '@_@TAB_CHAR@_@'))
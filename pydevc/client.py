@@ -13,25 +13,21 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 "Implements client-side communication protocol for PyDev debugger."
 
-import enum
+import collections
+import concurrent.futures
 import functools
-import html
+import itertools
 import logging
 import os
-import re
 import signal
 import socket
 import threading
 import time
-import urllib.parse
-import xml.etree.ElementTree as ET
 import queue
 
 from _pydevd_bundle.pydevd_comm import (
     CMD_RUN,
     CMD_VERSION,
-    CMD_SET_BREAK,
-    CMD_REMOVE_BREAK,
     CMD_THREAD_CREATE,
     CMD_THREAD_SUSPEND,
     CMD_THREAD_KILL,
@@ -42,21 +38,35 @@ from _pydevd_bundle.pydevd_comm import (
     CMD_SMART_STEP_INTO,
     CMD_LIST_THREADS,
     CMD_EVALUATE_EXPRESSION,
-    CMD_GET_FRAME
+    CMD_GET_FRAME,
+    CMD_GET_VARIABLE,
+    CMD_WRITE_TO_CONSOLE
 )
 
+from .breakpoints import BreakpointRegistry
+from .logpoints import LogpointStream, iter_log_messages
+from .protocol import (
+    decode_message,
+    encode_message,
+    is_reply,
+    new_breakpoint,
+    parse_pid,
+    parse_suspend,
+    parse_threads,
+    parse_value,
+    parse_version,
+    remove_break_command,
+    temporary_breakpoint_hit,
+    update_breakpoint,
+)
+from .source import source_cache
+from .stats import Metrics, command_name
+from .threads import ThreadTable
+from .trace import TraceRecorder
+from .transport import MessageReader, MessageWriter
+from .variables import EvaluationCache, VariableCache
+from .xmlstream import iter_variables
 
-class State(enum.Enum):
-    RUNNING = 0
-    SUSPENDED = 1
-
-
-MAX_BREAKPOINTS = 1024
-PYDEV_INTERNAL_THREADS = [
-    'pydevd.Writer',
-    'pydevd.CommandThread"',
-    'pydevd.Reader'
-]
 
 logger = logging.getLogger(__name__)
 
@@ -68,7 +78,11 @@ class PyDevClient(threading.Thread):
     EVENT_THREAD_SUSPEND = 'thread_suspend'
     EVENT_SET_BREAKPOINT = 'breakpoint_set'
     EVENT_REMOVE_BREAKPOINT = 'breakpoint_remove'
+    EVENT_SET_BREAKPOINTS = 'breakpoints_set'
+    EVENT_REMOVE_BREAKPOINTS = 'breakpoints_remove'
     EVENT_SERVER_EXIT = 'server_exit'
+    EVENT_FRAME_LOCALS = 'frame_locals'
+    EVENT_WATCHES = 'watches'
 
     def __init__(self, host, port):
         super().__init__(daemon=True)
@@ -79,21 +93,60 @@ class PyDevClient(threading.Thread):
         self.conn = None
         self.pid = None
 
+        # Requests waiting for a reply, keyed by message id.
         self.reply_lock = threading.Lock()
-        self.reply_queue = {}
+        self.pending_replies = {}
+
+        # Counters and latencies of the connection, and when each pending
+        # request was sent as (command name, time).
+        self.metrics = Metrics()
+        self._request_times = {}
 
-        self.breakpoints = {}
+        self.breakpoints = BreakpointRegistry()
 
-        self.thread_lock = threading.Lock()
-        self.threads = {}
+        self.threads = ThreadTable()
 
         self.callbacks = {}
-        self._active_thread = None
-        self._active_frames = []
+
+        # Suspends seen per thread as (count, position), for waiting on a
+        # thread to stop. The position is None once the thread is gone.
+        self.suspend_cond = threading.Condition()
+        self._suspends = {}
+        self._closed = False
+
+        # Variables of suspended frames, dropped when the thread moves on.
+        self.variables = VariableCache(self.__fetch_variables)
+
+        # Values of evaluated expressions, for the same stop and frame.
+        self.evaluations = EvaluationCache(self.__evaluate_batch)
+
+        # Watch expressions by id, evaluated in one batch on every suspend
+        # and delivered with EVENT_WATCHES.
+        self.watches = collections.OrderedDict()
+        self._watch_ids = itertools.count(1)
+
+        # When set, locals of the top frame are fetched in the background on
+        # every suspend and delivered with EVENT_FRAME_LOCALS, values cut to
+        # locals_value_length characters.
+        self.prefetch_locals = False
+        self.locals_value_length = None
+        self._prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        # Output of logpoints, delivered to its sinks in batches.
+        self.logpoints = LogpointStream()
 
         self.write_lock = threading.Lock()
+        self.writer = None
+        self.reader = None
 
+        # Records the traffic to a file when set, see start_trace.
+        self.trace = None
+
+        # Spontaneous events are handed from the reader to a single dispatcher
+        # thread, so that they are processed in the order they were sent.
+        # Replies bypass the queue and are routed by the reader directly.
         self.queue = queue.Queue()
+        self._dispatcher = None
 
     def connect(self, timeout=5):
         """Connect to the remote debugger."""
@@ -109,162 +162,267 @@ class PyDevClient(threading.Thread):
         else:
             raise TimeoutError('Connection timed out')
 
-    def __get_breakpoint_id(self):
-        for i in range(MAX_BREAKPOINTS):
-            if i not in self.breakpoints:
+        # Writes are coalesced already, and Nagle's algorithm would hold a
+        # write back until the previous one has been acknowledged.
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.attach(self.conn)
+
+    def attach(self, conn):
+        """Use an already connected socket, e.g. to replay a trace."""
+        self.conn = conn
+        self.writer = MessageWriter(self.conn)
+        self.writer.start()
+
+    def start_trace(self, path):
+        """Record all messages to and from the server to a trace file.
 
-                # Set a placeholder so that the id gets taken.
-                self.breakpoints[i] = None
-                return i
-        raise RuntimeError('Breakpoint limit ({}) reached'
-                           .format(MAX_BREAKPOINTS))
+        See pydevc.trace for the format and for replaying the trace.
+        """
+        self.stop_trace()
+        self.trace = TraceRecorder(path, host=self.host, port=self.port)
 
-    def __send(self, *args):
+    def stop_trace(self):
+        """Stop recording messages and close the trace file."""
+        trace, self.trace = self.trace, None
+        if trace is not None:
+            trace.close()
 
-        # Even when there are no args, the final separator is required.
-        if len(args) < 2:
-            args += ('',)
+    def __send(self, *args, expect_reply=False):
+        return self.__send_batch([args], expect_reply=expect_reply)[0]
 
-        # Inject message id. Client uses odd ids while server uses even ids.
-        _id = self.msg_id
-        self.msg_id += 2
-        msg = args[:1] + (_id,) + args[1:]
+    def __send_batch(self, commands, expect_reply=False):
+        """Send many messages with a single write.
 
-        msg = '\t'.join([str(m) for m in msg]) + '\n'
+        Returns an (id, future) pair for each message. The future holds the
+        reply when one is expected, otherwise it is None.
+        """
+        requests, data = [], []
 
-        logger.debug('>>> ' + msg)
         with self.write_lock:
-            self.conn.send(msg.encode('utf-8'))
-        return _id
+            sent_at = time.perf_counter()
+            for args in commands:
+                _id = self.msg_id
+                self.msg_id += 2
+                msg = encode_message(_id, *args)
+
+                # The waiter has to exist before the request is out, otherwise
+                # the reply could arrive before anyone is waiting for it.
+                name = command_name(args[0])
+                future = None
+                if expect_reply:
+                    future = concurrent.futures.Future()
+                    with self.reply_lock:
+                        self.pending_replies[_id] = future
+                        self._request_times[_id] = (name, sent_at)
+
+                self.metrics.count('sent.' + name)
+                logger.debug('>>> %s', msg)
+                requests.append((_id, future))
+                data.append(msg)
+
+            trace = self.trace
+            if trace is not None:
+                trace.sent(data)
+            data = [msg.encode('utf-8') for msg in data]
+
+            # Queued under the lock, so that messages go out in id order. A
+            # request is written right away as its caller will wait anyway.
+            try:
+                self.writer.write(data, immediate=expect_reply)
+            except (ConnectionError, OSError):
+                self.__forget_replies(
+                    [_id for _id, future in requests if future is not None])
+                raise
+        return requests
 
     def __run_callback(self, key, *args):
         if key in self.callbacks:
+            start = time.perf_counter()
             self.callbacks[key](*args)
+            self.metrics.observe('callback.' + key,
+                                 time.perf_counter() - start)
 
     def __event(self, cmd, msg_id, args):
         if cmd == CMD_THREAD_CREATE:
 
             # XML seems to always contain just one thread, but prepare for N.
-            for thread in ET.fromstring(args[0]):
-
-                thread_id = thread.attrib['id']
-                thread_name = thread.attrib['name']
-
-                with self.thread_lock:
-                    if self._active_thread is None:
-                        self._active_thread = thread_id
-                        self.threads[thread_id] = {
-                            'id': thread_id,
-                            'name': thread_name,
-                            'state': State.RUNNING,
-                            'file': None,
-                            'line': None,
-                            'function': None
-                        }
-
+            for thread_id, name in parse_threads(args[0]):
+                thread = self.threads.create(thread_id, name)
                 self.__run_callback(PyDevClient.EVENT_THREAD_CREATE,
-                                    thread_id, thread_name)
+                                    thread.id, thread.name)
 
         if cmd == CMD_THREAD_KILL:
             thread_id = args[0]
-            try:
-                thread_name = self.threads[thread_id]['name']
-            except KeyError:
+            thread = self.threads.kill(thread_id)
+            if thread is None:
                 # Seems that sometimes pydevd does not correctly report about
                 # created threads
                 logger.debug('Killed nonexistent thread: %s', thread_id)
-                # TODO: Maybe callbacks here still?
                 return
-            with self.thread_lock:
-                del self.threads[thread_id]
-                if self._active_thread == thread_id:
-                    if not self.threads:
-                        self._active_thread = None
-                    else:
-                        # Just pick the first available thread as the active
-                        # one.
-                        self._active_thread = list(self.threads.keys())[0]
-            self.__run_callback(PyDevClient.EVENT_THREAD_CREATE,
-                                thread_id, thread_name)
+            self.variables.invalidate(thread_id)
+            self.evaluations.invalidate(thread_id)
+            self.__record_suspend(thread_id, None)
+            self.__run_callback(PyDevClient.EVENT_THREAD_KILL,
+                                thread_id, thread.name)
 
         if cmd == CMD_THREAD_SUSPEND:
-            for thread in ET.fromstring(args[0]):
-                thread_id = thread.attrib['id']
-
-                self.__delete_if_temporary_breakpoint_hit(thread)
-
-                frame = thread[0]
-                self._active_frames = [f.attrib['id'] for f in thread]
-
-                # TODO: Seems that we need to unquote the string twice, figure
-                #       out why.
-                filename = unquote(unquote(frame.attrib['file']))
-                line_no = frame.attrib['line']
-                function = unquote(frame.attrib['name'])
-
-                with self.thread_lock:
-                    self._active_thread = thread_id
-
-                    if thread_id not in self.threads:
-                        self.threads[thread_id] = {}
+            with self.metrics.timed('parse.CMD_THREAD_SUSPEND'):
+                suspended = parse_suspend(args[0])
+
+            for thread_id, stop_reason, frames in suspended:
+                temporary = temporary_breakpoint_hit(self.breakpoints,
+                                                     stop_reason, frames[0])
+                if temporary is not None:
+                    self.remove_breakpoint(temporary['id'])
+
+                self.variables.invalidate(thread_id)
+                self.evaluations.invalidate(thread_id)
+                thread = self.threads.suspend(thread_id, frames, stop_reason)
+
+                # Waiters are woken up before the callbacks run, a callback
+                # that steps again must see this stop counted.
+                frame = frames[0]
+                self.__record_suspend(thread_id, frame.position)
+                self.__run_callback(PyDevClient.EVENT_THREAD_SUSPEND,
+                                    *frame.position)
+
+                if self.prefetch_locals:
+                    self._prefetcher.submit(self.__prefetch_locals,
+                                            thread_id, frame.id)
+                if self.watches:
+                    self._prefetcher.submit(self.__refresh_watches,
+                                            thread_id, frame.id)
+
+    def __record_suspend(self, thread_id, position):
+        """Wake up whoever waits for the thread to stop."""
+        with self.suspend_cond:
+            count, _ = self._suspends.get(thread_id, (0, None))
+            self._suspends[thread_id] = (count + 1, position)
+            self.suspend_cond.notify_all()
+
+    def __wait_for_suspend(self, thread_id, count, timeout=None):
+        """Wait until the thread has stopped more than count times.
+
+        Returns the position where the thread stopped.
+        """
+        def _suspended():
+            return self._closed or self._suspends.get(thread_id,
+                                                      (0, None))[0] > count
 
-                    self.threads[thread_id].update(dict(
-                        state=State.SUSPENDED,
-                        file=filename,
-                        line=line_no,
-                        function=function
-                    ))
+        with self.suspend_cond:
+            if not self.suspend_cond.wait_for(_suspended, timeout):
+                raise TimeoutError('Thread did not stop in time')
+            if self._suspends.get(thread_id, (0, None))[0] <= count:
+                raise ConnectionError('Connection to server closed')
+            _, position = self._suspends[thread_id]
 
-                self.__run_callback(PyDevClient.EVENT_THREAD_SUSPEND,
-                                    filename, line_no, function)
+        if position is None:
+            raise RuntimeError('Thread exited: {}'.format(thread_id))
+        return position
 
     def __process(self, message):
-        logger.debug('<<< ' + message)
-        cmd, msg_id, *args = message.split('\t')
-        msg_id = int(msg_id)
-        cmd = int(cmd)
-
-        if int(msg_id) % 2 == 1:
-            # A reply to a message from us, put it to the queue.
+        logger.debug('<<< %s', message)
+        trace = self.trace
+        if trace is not None:
+            trace.received(message)
+        cmd, msg_id, args = decode_message(message)
+
+        if is_reply(msg_id):
+            # A reply to a message from us, wake up whoever is waiting for it.
             with self.reply_lock:
-                self.reply_queue[msg_id] = args
+                future = self.pending_replies.get(msg_id)
+                request = self._request_times.pop(msg_id, None)
+            if request is not None:
+                name, sent_at = request
+                self.metrics.observe('rtt.' + name,
+                                     time.perf_counter() - sent_at)
+            if future is None:
+                logger.debug('Dropping unexpected reply %s', msg_id)
+            elif not future.done():
+                future.set_result(args)
+        elif cmd == CMD_WRITE_TO_CONSOLE:
+            # Logpoints can fire thousands of times a second, their output
+            # goes straight to the buffer instead of through the dispatcher.
+            for breakpoint_id, text in iter_log_messages(args[0]):
+                self.logpoints.push(breakpoint_id, text)
         else:
-            # A spontaneous event.
-            self.__event(cmd, msg_id, args)
+            # A spontaneous event, leave it for the dispatcher. The time it
+            # waits in the queue is the backlog of the dispatcher.
+            self.queue.put((cmd, msg_id, args, time.perf_counter()))
 
-    def __wait_for_reply(self, msg_id, timeout=5):
-        t0 = time.time()
+    def __dispatch(self):
+        """Handle spontaneous events in the order they were received.
 
-        while time.time() - t0 < timeout:
-            with self.reply_lock:
-                if msg_id in self.reply_queue:
-                    reply = self.reply_queue[msg_id]
-                    del self.reply_queue[msg_id]
-                    return reply
-            time.sleep(0.01)
-
-        raise TimeoutError('No reply from server received')
+        A None in the queue marks the end of the stream, after which the exit
+        callback is run.
+        """
+        while True:
+            event = self.queue.get()
+            if event is None:
+                self.__run_callback(PyDevClient.EVENT_SERVER_EXIT)
+                return
+            cmd, msg_id, args, queued_at = event
+            start = time.perf_counter()
+            self.metrics.observe('queue.wait', start - queued_at)
+            try:
+                self.__event(cmd, msg_id, args)
+            except Exception:  # pylint: disable=locally-disabled, broad-except
+                logger.exception('Failed to handle event %s', cmd)
+            self.metrics.observe('event.' + command_name(cmd),
+                                 time.perf_counter() - start)
+
+    def __wait_for_reply(self, request, timeout=5):
+        # The future is kept by the caller, the table may already have been
+        # cleared when the connection closed.
+        msg_id, future = request
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.metrics.count('timeout')
+            raise TimeoutError('No reply from server received') from None
+        finally:
+            self.__forget_replies([msg_id])
+
+    def __forget_replies(self, msg_ids):
+        """Stop waiting for requests, late replies will be dropped."""
+        with self.reply_lock:
+            for msg_id in msg_ids:
+                self.pending_replies.pop(msg_id, None)
+                self._request_times.pop(msg_id, None)
+
+    def __cancel_pending(self):
+        """Fail all outstanding requests, no replies will arrive anymore."""
+        with self.reply_lock:
+            pending = list(self.pending_replies.values())
+            self.pending_replies.clear()
+            self._request_times.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(
+                    ConnectionError('Connection to server closed'))
 
     def run(self):
         self.stopped = False
-        buf = ''
-
-        while not self.stopped:
-            d = self.conn.recv(1024).decode('utf-8')
-            if not d:
-                logger.debug('server closed the socket')
-                self.__run_callback(PyDevClient.EVENT_SERVER_EXIT)
-                return
 
-            d = buf + d
+        self._dispatcher = threading.Thread(target=self.__dispatch, daemon=True)
+        self._dispatcher.start()
+        self.logpoints.start()
 
-            # The messages are split by a newline.
-            while '\n' in d:
-                msg, d = d.split('\n', maxsplit=1)
-                # self.queue.put(msg)
+        self.reader = MessageReader(self.conn)
+        for msg in self.reader:
+            self.__process(msg)
+            if self.stopped:
+                return
 
-                threading.Thread(target=self.__process, args=[msg], daemon=True).start()
-            buf = d
+        logger.debug('server closed the socket')
+        self.writer.close()
+        self.stop_trace()
+        self.__cancel_pending()
+        self.logpoints.close()
+        with self.suspend_cond:
+            self._closed = True
+            self.suspend_cond.notify_all()
+        self.queue.put(None)
 
     def init(self, version, os_type=('WINDOWS' if os.name == 'nt' else 'UNIX'),
              breakpoint_method='ID'):
@@ -279,42 +437,84 @@ class PyDevClient(threading.Thread):
         points, thus we default to ids. To use line numbers as the ids set
         breakpoint_method='LINE')
         """
-        msg_id = self.__send(CMD_VERSION, version, os_type, breakpoint_method)
+        request = self.__send(CMD_VERSION, version, os_type, breakpoint_method,
+                              expect_reply=True)
 
-        server_version, *_ = self.__wait_for_reply(msg_id)
-        server_version = urllib.parse.unquote(server_version)
+        server_version = parse_version(self.__wait_for_reply(request))
         logger.debug('pydevd version: %s', server_version)
         return server_version
 
     def add_breakpoint(self, filename='', line_number='', function=None,
-                       condition=None, expression=None, _temporary=False):
+                       condition=None, expression=None, hit_count=None,
+                       ignore_count=None, log_message=None,
+                       _temporary=False):
         """Set a breakpoint into the debugged program.
+
+        The debugger only stops when the condition, a Python expression, is
+        true. Passes where it holds are counted inside the debuggee: the
+        first ignore_count of them are skipped, and with hit_count the
+        debugger stops on that pass only.
+
+        With log_message the breakpoint is a logpoint: instead of stopping,
+        the message is formatted like an f-string in the debuggee and
+        delivered through self.logpoints.
         """
-        breakpoint_id = self.__get_breakpoint_id()
-        self.__send(CMD_SET_BREAK, breakpoint_id, 'python-line', filename,
-                    line_number, function, condition, expression)
-        self.breakpoints[breakpoint_id] = {
-            'id': breakpoint_id,
-            'filename': filename,
-            'line': line_number,
-            'function': function,
-            'temporary': _temporary,
-            'enabled': True
-        }
+        breakpoint, command = new_breakpoint(
+            self.breakpoints, filename, line_number, function, condition,
+            expression, hit_count, ignore_count, log_message, _temporary)
+        self.__send(*command)
+
+        self.__run_callback(PyDevClient.EVENT_SET_BREAKPOINT, breakpoint)
+        return breakpoint['id']
+
+    def add_breakpoints(self, breakpoints):
+        """Set many breakpoints into the debugged program at once.
+
+        Takes an iterable of dicts with the arguments of add_breakpoint. All
+        breakpoints are sent with a single write and reported with a single
+        EVENT_SET_BREAKPOINTS event. Returns the ids of the breakpoints.
+        """
+        added, commands = [], []
+        for kwargs in breakpoints:
+            breakpoint, command = new_breakpoint(self.breakpoints, **kwargs)
+            added.append(breakpoint)
+            commands.append(command)
 
-        self.__run_callback(PyDevClient.EVENT_SET_BREAKPOINT,
-                            self.breakpoints[breakpoint_id])
-        return breakpoint_id
+        if commands:
+            self.__send_batch(commands)
+        self.__run_callback(PyDevClient.EVENT_SET_BREAKPOINTS, added)
+        return [bp['id'] for bp in added]
 
     def remove_breakpoint(self, breakpoint_id):
         """Remove a breakpoint from the debugged program.
         """
-        bp = self.breakpoints[breakpoint_id]
-        self.__send(CMD_REMOVE_BREAK, 'python-line', bp['filename'],
-                    breakpoint_id)
-        del self.breakpoints[breakpoint_id]
+        bp = self.breakpoints.remove(breakpoint_id)
+        self.__send(*remove_break_command(bp))
         self.__run_callback(PyDevClient.EVENT_REMOVE_BREAKPOINT, bp)
 
+    def remove_breakpoints(self, breakpoint_ids):
+        """Remove many breakpoints from the debugged program at once.
+
+        The breakpoints are removed with a single write and reported with a
+        single EVENT_REMOVE_BREAKPOINTS event.
+        """
+        removed = [self.breakpoints.remove(i) for i in breakpoint_ids]
+        if removed:
+            self.__send_batch([remove_break_command(bp) for bp in removed])
+        self.__run_callback(PyDevClient.EVENT_REMOVE_BREAKPOINTS, removed)
+
+    def update_breakpoint(self, breakpoint_id, **changes):
+        """Change the condition, expression, hit_count or ignore_count of a
+        breakpoint.
+
+        The breakpoint is set again under the same id, which also restarts
+        its hit count.
+        """
+        bp, command = update_breakpoint(self.breakpoints, breakpoint_id,
+                                        changes)
+        self.__send(*command)
+        self.__run_callback(PyDevClient.EVENT_SET_BREAKPOINT, bp)
+
     def start_debugger(self, filename=None, line_number=None):
         """Start the debugger.
 
@@ -329,14 +529,11 @@ class PyDevClient(threading.Thread):
                                 line_number=line_number,
                                 _temporary=True)
 
-        msg_id = self.__send(CMD_LIST_THREADS)
-        threads, = self.__wait_for_reply(msg_id)
+        request = self.__send(CMD_LIST_THREADS, expect_reply=True)
+        threads, = self.__wait_for_reply(request)
 
         # Figure out the PID of the project
-        for thread in ET.fromstring(threads):
-            thread_id = thread.attrib['id']
-            self.pid = int(thread_id.split('_')[1])
-            break
+        self.pid = parse_pid(threads)
 
         self.__send(CMD_RUN)
 
@@ -353,38 +550,25 @@ class PyDevClient(threading.Thread):
 
     def thread_info(self):
         """Get information on the threads of the debugged process. """
-        msg_id = self.__send(CMD_LIST_THREADS)
-        threads, = self.__wait_for_reply(msg_id)
-        for thread in ET.fromstring(threads):
-            name = unquote(thread.attrib['name'])
-            thread_id = unquote(thread.attrib['id'])
-            if name in PYDEV_INTERNAL_THREADS:
-                continue
-            if thread_id not in self.threads:
-                self.threads[thread_id] = {}
-
-            self.threads[thread_id]['name'] = name
-            self.threads[thread_id]['id'] = thread_id
+        request = self.__send(CMD_LIST_THREADS, expect_reply=True)
+        threads, = self.__wait_for_reply(request)
+        for thread_id, name in parse_threads(threads, internal=False):
+            self.threads.create(thread_id, name)
         return self.threads
 
+    def select_thread(self, thread):
+        """Make a thread, given by id or name, the active one."""
+        return self.threads.select(thread)
+
     # pylint: disable=locally-disabled, no-self-argument
     def thread_arg(f):
-        """A decorator for a command that takes an optional thread-name. """
+        """A decorator for a command that takes an optional thread id or name.
+        """
         @functools.wraps(f)
-        def _decorator(self, thread=None):
-
-            # pylint: disable=locally-disabled, protected-access
-            if thread is None and self._active_thread is None:
-                raise RuntimeError('No thread specified')
-
-            for tid, t in self.threads.items():
-                if t.get('name') == thread:
-                    thread_id = tid
-                    break
-            else:
-                thread_id = self._active_thread
+        def _decorator(self, thread=None, **kwargs):
+            thread_id = self.threads.resolve(thread)
             # pylint: disable=locally-disabled, not-callable
-            return f(self, thread_id)
+            return f(self, thread_id, **kwargs)
 
         return _decorator
 
@@ -402,138 +586,248 @@ class PyDevClient(threading.Thread):
 
     @thread_arg
     def get_position(self, thread_id):
-        thread = self.threads[thread_id]
-
-        if thread['state'] == State.RUNNING:
-            raise RuntimeError('Cannot get position of running thread.')
-
-        return thread.get('file'), int(thread.get('line')), thread.get('function')
+        return self.threads[thread_id].position
 
     @thread_arg
-    def step_over(self, thread_id):
-        self.__send(CMD_STEP_OVER, thread_id)
-        self.threads[thread_id]['state'] = State.RUNNING
-        self._active_frames = []
+    def select_frame(self, thread_id, index=0):
+        """Select the frame of a suspended thread that evaluate and the
+        variables are taken from, 0 being the innermost one.
 
-    @thread_arg
-    def step_into(self, thread_id, my_code=False):
-        self.__send(CMD_SMART_STEP_INTO if my_code else CMD_STEP_INTO, thread_id)
-        self.threads[thread_id]['state'] = State.RUNNING
-        self._active_frames = []
+        Returns the selected Frame. The stack is known from the suspend, so
+        this needs no round trip.
+        """
+        return self.threads[thread_id].select_frame(index)
 
     @thread_arg
-    def step_return(self, thread_id):
-        self.__send(CMD_STEP_RETURN, thread_id)
-        self.threads[thread_id]['state'] = State.RUNNING
-        self._active_frames = []
+    def frame_up(self, thread_id, count=1):
+        """Select a frame count levels further out, towards the caller."""
+        thread = self.threads[thread_id]
+        return thread.select_frame(thread.selected + count)
 
     @thread_arg
-    def continue_thread(self, thread_id):
-        self.__send(CMD_THREAD_RUN, thread_id)
-        self.threads[thread_id]['state'] = State.RUNNING
-        self._active_frames = []
-
-    def __delete_if_temporary_breakpoint_hit(self, thread):
-        if not thread.attrib['stop_reason'] == str(CMD_SET_BREAK):
-            return
+    def frame_down(self, thread_id, count=1):
+        """Select a frame count levels further in, towards the callee."""
+        thread = self.threads[thread_id]
+        return thread.select_frame(thread.selected - count)
 
-        frame = thread[0]
+    def __progress_thread(self, cmd, thread_id, wait, timeout):
+        """Let a suspended thread run.
 
-        # Find the breakpoint we had on that line
-        for breakpoint in self.breakpoints.values():
-            if (unquote(frame.attrib['file']) == breakpoint['filename']
-                    and frame.attrib['line'] == breakpoint['line']
-                    and breakpoint['temporary']):
-                self.remove_breakpoint(breakpoint['id'])
-                break
+        With wait, block until the thread stops again and return its new
+        position. Raises TimeoutError if that takes longer than timeout
+        seconds, RuntimeError if the thread exits, and ConnectionError if
+        the server does. Callbacks can not wait.
+        """
+        # Callbacks run in the dispatcher, which is the thread that would
+        # deliver the suspend.
+        if wait and threading.current_thread() is self._dispatcher:
+            raise RuntimeError('Cannot wait for a suspend in a callback')
 
-    def evaluate(self, expression):
-        """Evaluate expression in current context. """
+        with self.suspend_cond:
+            count, _ = self._suspends.get(thread_id, (0, None))
 
-        # NOTE: Evaluation can be done in other frames as well, but we need some
-        #       intuitive way to the user to select the evaluation context.
-        if not self._active_frames:
-            raise RuntimeError('No active frame')
+        # The thread is marked running before the command goes out, so that a
+        # quick suspend is not overwritten.
+        self.variables.invalidate(thread_id)
+        self.evaluations.invalidate(thread_id)
+        self.threads.resume(thread_id)
+        self.__send(cmd, thread_id)
 
-        msg_id = self.__send(CMD_EVALUATE_EXPRESSION, self._active_thread,
-                             self._active_frames[0], None, expression, 1)
-        reply = self.__wait_for_reply(msg_id, timeout=10)
+        if wait:
+            return self.__wait_for_suspend(thread_id, count, timeout)
+        return None
 
-        result = ET.fromstring(reply[0])
-        return unquote(unquote(result[0].attrib['value']))
+    @thread_arg
+    def step_over(self, thread_id, wait=False, timeout=None):
+        return self.__progress_thread(CMD_STEP_OVER, thread_id, wait, timeout)
 
-    def get_locals(self):
-        """Get values of local variables """
-        if not self._active_frames:
-            raise RuntimeError('No active frame')
+    @thread_arg
+    def step_into(self, thread_id, my_code=False, wait=False, timeout=None):
+        return self.__progress_thread(
+            CMD_SMART_STEP_INTO if my_code else CMD_STEP_INTO, thread_id,
+            wait, timeout)
 
-        msg_id = self.__send(CMD_GET_FRAME, self._active_thread,
-                             self._active_frames[0], None)
-        reply = self.__wait_for_reply(msg_id, timeout=10)
-        result = ET.fromstring(unquote(reply[0]))
+    @thread_arg
+    def step_return(self, thread_id, wait=False, timeout=None):
+        return self.__progress_thread(CMD_STEP_RETURN, thread_id, wait,
+                                      timeout)
 
-        return {
-            unquote(var.attrib['name']): {
-                'type': unquote(var.attrib['type']),
-                'value': unquote(var.attrib['value']),
-                'qualifier': unquote(var.attrib['qualifier']),
-                'container': unquote(var.attrib.get('isContainer', '')) == 'True',
-            } for var in result
-        }
+    @thread_arg
+    def continue_thread(self, thread_id, wait=False, timeout=None):
+        return self.__progress_thread(CMD_THREAD_RUN, thread_id, wait,
+                                      timeout)
 
+    def evaluate(self, expression, cache=True):
+        """Evaluate expression in the selected frame of the active thread.
 
-def unquote(string):
-    """Remove html escaping and urlencoding. """
-    return html.unescape(urllib.parse.unquote(string))
+        The value is remembered until the thread moves on, so evaluating the
+        same expression again in the same stop is served locally. Pass
+        cache=False for expressions with side effects.
+        """
+        thread, frame = self.threads.active_frame()
+        if not cache:
+            return self.__evaluate_batch(thread.id, frame.id, [expression])[0]
+        return self.evaluations.get(thread.id, frame.id, expression)
 
+    def __evaluate_batch(self, thread_id, frame_id, expressions):
+        """Evaluate expressions with pipelined requests, returns the values.
+        """
+        requests = self.__send_batch([
+            (CMD_EVALUATE_EXPRESSION, thread_id, frame_id, None, expression,
+             1)
+            for expression in expressions
+        ], expect_reply=True)
+        values = []
+        try:
+            for request in requests:
+                reply = self.__wait_for_reply(request, timeout=10)
+                with self.metrics.timed('parse.CMD_EVALUATE_EXPRESSION'):
+                    values.append(parse_value(reply[0]))
+        finally:
+            # After a failure the rest of the batch is not waited for.
+            self.__forget_replies([msg_id for msg_id, _ in requests])
+        return values
+
+    def add_watch(self, expression):
+        """Watch an expression, returns the id of the watch.
+
+        Watches are evaluated in the top frame of every thread that suspends
+        and delivered with EVENT_WATCHES.
+        """
+        watch_id = next(self._watch_ids)
+        self.watches[watch_id] = expression
+        return watch_id
 
-def find_first_statement(filename):
-    """Finds the line number of the first statement in the file.
+    def remove_watch(self, watch_id):
+        """Stop watching an expression."""
+        try:
+            del self.watches[watch_id]
+        except KeyError:
+            raise RuntimeError('No watch number {}'.format(watch_id)) from None
 
-    The statement is either a regular statement, class or function definition
-    or a module docstring. The line number returned for the docstring is the
-    end of the docstring since that is the line which will accept a breakpoint.
-    """
+    def evaluate_watches(self):
+        """Values of the watches in the selected frame of the active thread.
 
-    with open(filename, 'rt', encoding='utf-8') as f:
-        lines = f.readlines()
+        Returns a list of (id, expression, value).
+        """
+        thread, frame = self.threads.active_frame()
+        return self.__evaluate_watches(thread.id, frame.id)
+
+    def __evaluate_watches(self, thread_id, frame_id):
+        watches = list(self.watches.items())
+        values = self.evaluations.get_many(
+            thread_id, frame_id, [expression for _, expression in watches])
+        return [(watch_id, expression, value)
+                for (watch_id, expression), value in zip(watches, values)]
+
+    def __refresh_watches(self, thread_id, frame_id):
+        """Evaluate the watches after a suspend and run the watch callback.
+        """
+        thread = self.threads.get(thread_id)
+        if thread is None or not thread.frames or \
+                thread.frames[0].id != frame_id:
+            return
+        try:
+            results = self.__evaluate_watches(thread_id, frame_id)
+        except (TimeoutError, ConnectionError) as e:
+            logger.debug('Evaluating watches failed: %s', e)
+            return
+        self.__run_callback(PyDevClient.EVENT_WATCHES,
+                            thread_id, frame_id, results)
+
+    def __fetch_variables(self, thread_id, frame_id, path):
+        if path:
+            cmd = CMD_GET_VARIABLE
+            request = self.__send(cmd, thread_id, frame_id, 'FRAME', *path,
+                                  expect_reply=True)
+        else:
+            cmd = CMD_GET_FRAME
+            request = self.__send(cmd, thread_id, frame_id, None,
+                                  expect_reply=True)
+        reply = self.__wait_for_reply(request, timeout=10)
+        with self.metrics.timed('parse.' + command_name(cmd)):
+            return list(iter_variables(reply[0]))
+
+    def __prefetch_locals(self, thread_id, frame_id):
+        """Fetch locals of a suspended frame and run the locals callback.
+
+        Runs outside of the event dispatcher, so that suspend events are not
+        held up by the round trip. Frames the thread has already left are
+        skipped.
+        """
+        def _stale():
+            thread = self.threads.get(thread_id)
+            return (thread is None or not thread.frames
+                    or thread.frames[0].id != frame_id)
 
-    empty = re.compile(r'^\s*$')
-    comment = re.compile(r'^\s*#.*')
+        if _stale():
+            return
+        try:
+            variables = self.variables.get(thread_id, frame_id)
+        except (TimeoutError, ConnectionError) as e:
+            logger.debug('Prefetching locals failed: %s', e)
+            return
+        if _stale():
+            return
 
-    docstr_1 = re.compile(r'^\s*""".*')
-    docstr_1_end = re.compile(r'.*""".*')
-    docstr_1_matched = False
-    docstr_2 = re.compile(r'^\s*\'\'\'.*')
-    docstr_2_end = re.compile(r'.*\'\'\'.*')
-    docstr_2_matched = False
+        length = self.locals_value_length
+        frame_locals = {name: variable.to_dict(length)
+                        for name, variable in variables.items()}
 
-    for index, line in enumerate(lines):
-        if empty.match(line) or comment.match(line):
-            continue
+        self.__run_callback(PyDevClient.EVENT_FRAME_LOCALS,
+                            thread_id, frame_id, frame_locals)
 
-        if docstr_1_matched and docstr_1_end.match(line):
-            return index + 1
+    def get_variables(self):
+        """Get the variables of the selected frame as a tree.
 
-        if docstr_2_matched and docstr_2_end.match(line):
-            return index + 1
+        Returns the top-level variables by name. Children of containers are
+        fetched when they are first accessed, and the whole tree is cached
+        until the thread is stepped, continued or suspends again.
+        """
+        thread, frame = self.threads.active_frame()
+        return self.variables.get(thread.id, frame.id)
 
-        if not docstr_1_matched and docstr_1.match(line):
-            if docstr_1_end.match(line.replace('"""', '', 1)):
-                return index + 1
+    def get_locals(self):
+        """Get values of local variables """
+        return {
+            name: variable.to_dict()
+            for name, variable in self.get_variables().items()
+        }
 
-            docstr_1_matched = True
-            continue
+    def get_stats(self):
+        """Counters and latencies of the connection, see stats.Metrics.
 
-        if not docstr_2_matched and docstr_2.match(line):
-            if docstr_2_end.match(line.replace('\'\'\'', '', 1)):
-                return index + 1
+        Latencies are in seconds. The gauges hold the current state: number
+        of threads, requests waiting for a reply, events waiting for the
+        dispatcher and the traffic so far.
+        """
+        threads = self.threads.values()
+        writer, reader = self.writer, self.reader
+        with self.reply_lock:
+            pending = len(self.pending_replies)
+        return self.metrics.snapshot(
+            threads=len(threads),
+            suspended_threads=sum(1 for t in threads if t.suspended),
+            pending_replies=pending,
+            event_backlog=self.queue.qsize(),
+            bytes_sent=writer.bytes_sent if writer else 0,
+            messages_sent=writer.messages_sent if writer else 0,
+            writes=writer.writes if writer else 0,
+            bytes_received=reader.bytes_received if reader else 0,
+            messages_received=reader.messages_received if reader else 0,
+            logpoints=self.logpoints.stats(),
+        )
+
+    def reset_stats(self):
+        """Start measuring counters and latencies from zero."""
+        self.metrics.reset()
 
-            docstr_2_matched = True
-            continue
 
-        if docstr_1_matched or docstr_2_matched:
-            continue
+def find_first_statement(filename):
+    """Finds the line number of the first statement in the file.
 
-        # First line not matching anything is assumed to be a statement
-        return index + 1
+    The statement is either a regular statement, class or function definition
+    or a module docstring, whichever is the first line where the interpreter
+    will stop at a breakpoint. The result is cached until the file changes.
+    """
+    return source_cache.get(filename).first_statement()
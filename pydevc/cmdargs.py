@@ -14,6 +14,16 @@
 """Command line argument parser for pydevc"""
 
 import argparse
+import re
+
+
+def parse_session(s):
+    """Parse a session definition of form name=host:port."""
+    match = re.compile(r'^([^=]+)=(.+):(\d+)$').match(s)
+    if not match:
+        raise argparse.ArgumentTypeError(
+            'invalid session, expected NAME=HOST:PORT: {}'.format(s))
+    return match.group(1), match.group(2), int(match.group(3))
 
 
 def parse_options(argv):
@@ -31,6 +41,15 @@ def parse_options(argv):
         type=int,
         help='port number of pydevd'
     )
+    parser.add_argument(
+        '--session',
+        action='append',
+        type=parse_session,
+        dest='sessions',
+        metavar='NAME=HOST:PORT',
+        help='connect to a named pydevd session, can be given multiple times '
+        'to debug many processes at once'
+    )
     parser.add_argument(
         '-f', '--file',
         action='store',
@@ -55,6 +74,58 @@ def parse_options(argv):
         help='if true, the script will suspend at first line of the file'
     )
 
+    parser.add_argument(
+        '--breakpoint-store',
+        action='store',
+        metavar='PATH',
+        help='file where breakpoints are kept between sessions, defaults to a '
+        'per-project file under $XDG_DATA_HOME/pydevc'
+    )
+    parser.add_argument(
+        '--no-breakpoint-store',
+        action='store_true',
+        help='do not save or restore breakpoints'
+    )
+
+    parser.add_argument(
+        '--logpoint-file',
+        action='store',
+        metavar='PATH',
+        help='append the output of logpoints to PATH instead of printing it'
+    )
+
+    parser.add_argument(
+        '--stats-file',
+        action='store',
+        metavar='PATH',
+        help='append counters and latencies of the session to PATH as JSON '
+        'lines while debugging'
+    )
+    parser.add_argument(
+        '--stats-interval',
+        action='store',
+        type=float,
+        metavar='SECONDS',
+        help='seconds between two entries of --stats-file, defaults to 10'
+    )
+
+    parser.add_argument(
+        '--trace',
+        action='store',
+        metavar='PATH',
+        help='record the messages to and from pydevd to PATH, gzipped if it '
+        'ends with .gz, for replaying with python -m pydevc.trace; not '
+        'supported with --session'
+    )
+
+    parser.add_argument(
+        '--script',
+        action='store',
+        metavar='FILE',
+        help='run the debugger commands in FILE without a prompt and print '
+        'the result of each as a JSON line'
+    )
+
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -67,4 +138,13 @@ def parse_options(argv):
         action='store_true'
     )
 
-    return parser.parse_args(argv)
+    options = parser.parse_args(argv)
+
+    # Sessions run on AsyncPyDevClient, which neither prefetches locals nor
+    # records a trace.
+    if options.sessions:
+        if options.print_locals == 'lisp':
+            parser.error('--print-locals lisp is not supported with --session')
+        if options.trace:
+            parser.error('--trace is not supported with --session')
+    return options
@@ -0,0 +1,262 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Logpoints: breakpoints that log a message instead of stopping.
+
+The message is formatted inside the debuggee and sent back as console output
+tagged with the id of the logpoint, so the thread never suspends. On the
+client the messages are buffered and handed to sinks in batches.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from .xmlstream import iter_nodes
+
+# Marks console output written by a logpoint, followed by "<id>@".
+LOG_PREFIX = '@pydevc-log@'
+
+# The debugger object inside the debuggee, reachable from any frame.
+GLOBAL_DEBUGGER = ("__import__('_pydevd_bundle.pydevd_comm', "
+                   "fromlist=['get_global_debugger']).get_global_debugger()")
+
+# Messages kept waiting for the sinks before the overflow policy applies.
+MAX_PENDING = 100000
+
+# Longest time a message waits in the buffer, in seconds.
+FLUSH_INTERVAL = 0.05
+
+logger = logging.getLogger(__name__)
+
+LogRecord = collections.namedtuple('LogRecord',
+                                   ['time', 'breakpoint_id', 'message'])
+
+
+def log_condition(breakpoint_id, message):
+    """Build a breakpoint condition that logs the message and never stops.
+
+    The message is a template like an f-string, e.g. 'n = {n}', evaluated in
+    the frame of the logpoint. It is formatted outside the lambda, whose body
+    would only see the globals of the frame.
+    """
+    tag = '{}{}@'.format(LOG_PREFIX, breakpoint_id)
+    return ('(lambda d, m: d.cmd_factory.make_io_message({!r} + m, 1, d) '
+            'and False)({}, f{!r})'.format(tag, GLOBAL_DEBUGGER, message))
+
+
+def parse_log_message(text):
+    """Split logpoint output into the logpoint id and the message.
+
+    Returns None for console output that is not from a logpoint.
+    """
+    if not text.startswith(LOG_PREFIX):
+        return None
+    breakpoint_id, _, message = text[len(LOG_PREFIX):].partition('@')
+    try:
+        return int(breakpoint_id), message
+    except ValueError:
+        return None
+
+
+def iter_log_messages(payload):
+    """Logpoint ids and messages in a CMD_WRITE_TO_CONSOLE payload."""
+    for node in iter_nodes(payload, ('io',)):
+        parsed = parse_log_message(node.get('s', ''))
+        if parsed is not None:
+            yield parsed
+
+
+def stream_sink(stream):
+    """A sink writing each message as a line to a text stream."""
+    def _sink(records):
+        stream.write(''.join('[logpoint {}] {}\n'.format(r.breakpoint_id,
+                                                          r.message)
+                             for r in records))
+        stream.flush()
+    return _sink
+
+
+def file_sink(path):
+    """A sink appending messages to a file, returns the sink and the file.
+
+    Each line holds the time the message was received, the logpoint id and
+    the message, separated by tabs.
+    """
+    f = open(path, 'at', encoding='utf-8')  # pylint: disable=locally-disabled, consider-using-with
+
+    def _sink(records):
+        f.write(''.join('{:.6f}\t{}\t{}\n'.format(*r) for r in records))
+        f.flush()
+    return _sink, f
+
+
+class LogpointStream:
+    """Buffer for logpoint messages, delivered to sinks in batches.
+
+    push() only appends to a buffer, a flusher thread hands everything that
+    has arrived to the sinks at most every flush_interval seconds, or as soon
+    as batch_size messages are waiting. When max_pending messages are waiting
+    the overflow policy applies: 'drop' discards new messages and counts them
+    in dropped, 'block' makes push() wait, which stops reading from the
+    server until the sinks catch up.
+
+    Sinks are callables taking a list of LogRecords, run in the flusher
+    thread. A stream started with an asyncio loop has no thread, deliveries
+    are scheduled on the loop instead and push() must be called from it.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING, flush_interval=FLUSH_INTERVAL,
+                 batch_size=1000, overflow='drop'):
+        if overflow not in ('drop', 'block'):
+            raise ValueError('Unknown overflow policy: {}'.format(overflow))
+
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.sinks = []
+
+        self.cond = threading.Condition()
+        self.pending = collections.deque()
+        self.flushing = False
+        self.closed = False
+        self._flusher = None
+        self._loop = None
+        self._timer = None
+
+        # Messages received, delivered to sinks and dropped on overflow.
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def start(self, loop=None):
+        """Start delivering messages, in the given asyncio loop if any."""
+        if loop is None:
+            self._flusher = threading.Thread(target=self.__run, daemon=True)
+            self._flusher.start()
+            return
+        if self.overflow == 'block':
+            raise ValueError('Cannot block an event loop on overflow')
+        self._loop = loop
+
+    def add_sink(self, sink):
+        """Add a callable receiving lists of LogRecords."""
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def push(self, breakpoint_id, message):
+        """Queue a message of a logpoint."""
+        record = LogRecord(time.time(), breakpoint_id, message)
+        with self.cond:
+            self.received += 1
+            if len(self.pending) >= self.max_pending:
+                if self.overflow == 'drop':
+                    self.dropped += 1
+                    return
+                self.cond.wait_for(
+                    lambda: self.closed
+                    or len(self.pending) < self.max_pending)
+            self.pending.append(record)
+            if len(self.pending) in (1, self.batch_size):
+                self.cond.notify_all()
+                if self._loop is not None:
+                    self.__schedule(len(self.pending) < self.batch_size)
+
+    def flush(self, timeout=None):
+        """Wait until the queued messages have been delivered."""
+        with self.cond:
+            self.cond.notify_all()
+            return self.cond.wait_for(
+                lambda: not self.pending and not self.flushing, timeout)
+
+    def close(self):
+        """Deliver what is left and stop the flusher.
+
+        A stream running in a loop has to be closed from the loop.
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+        if self._loop is not None:
+            if self._timer is not None:
+                self._timer.cancel()
+            self.__flush_pending()
+
+    def stats(self):
+        """Counters of the stream."""
+        with self.cond:
+            return {
+                'received': self.received,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'pending': len(self.pending),
+            }
+
+    def __schedule(self, wait):
+        # The first message waits for more, a full batch goes right away.
+        if self._timer is not None:
+            if wait:
+                return
+            self._timer.cancel()
+        delay = self.flush_interval if wait else 0
+        self._timer = self._loop.call_later(delay, self.__flush_pending)
+
+    def __flush_pending(self):
+        with self.cond:
+            self._timer = None
+            records = list(self.pending)
+            self.pending.clear()
+            self.flushing = bool(records)
+        if records:
+            self.__deliver(records)
+
+    def __deliver(self, records):
+        for sink in list(self.sinks):
+            try:
+                sink(records)
+            except Exception:  # pylint: disable=locally-disabled, broad-except
+                logger.exception('Logpoint sink failed')
+
+        with self.cond:
+            self.delivered += len(records)
+            self.flushing = False
+            self.cond.notify_all()
+
+    def __run(self):
+        while True:
+            with self.cond:
+                # Sleep until there is something to deliver, then give more
+                # messages a moment to arrive.
+                self.cond.wait_for(lambda: self.closed or self.pending)
+                self.cond.wait_for(
+                    lambda: self.closed
+                    or len(self.pending) >= self.batch_size,
+                    self.flush_interval)
+                records = list(self.pending)
+                self.pending.clear()
+                self.flushing = bool(records)
+                closed = self.closed
+                # Room for blocked pushers.
+                self.cond.notify_all()
+
+            if records:
+                self.__deliver(records)
+
+            if closed:
+                return
@@ -0,0 +1,177 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""The PyDev debugger protocol, without any I/O.
+
+Builds the messages sent to pydevd and turns the payloads it sends back into
+plain values. PyDevClient and AsyncPyDevClient share this module and only
+differ in how they move the messages and wait for replies.
+"""
+
+import urllib.parse
+
+from _pydevd_bundle.pydevd_comm import (
+    CMD_SET_BREAK,
+    CMD_REMOVE_BREAK,
+)
+
+from .breakpoints import set_break_args
+from .source import source_cache
+from .threads import Frame
+from .xmlstream import iter_nodes, iter_threads, iter_variables
+
+
+PYDEV_INTERNAL_THREADS = [
+    'pydevd.Writer',
+    'pydevd.CommandThread"',
+    'pydevd.Reader'
+]
+
+# Fields of a breakpoint that can be changed after it has been set.
+UPDATABLE_FIELDS = frozenset(['condition', 'expression', 'hit_count',
+                              'ignore_count', 'log_message'])
+
+
+def encode_message(msg_id, cmd, *args):
+    """A message as sent on the wire, terminated by a newline.
+
+    Client uses odd ids while server uses even ids.
+    """
+    # Even when there are no args, the final separator is required.
+    if not args:
+        args = ('',)
+    return '\t'.join([str(m) for m in (cmd, msg_id) + args]) + '\n'
+
+
+def decode_message(message):
+    """Split a received message into its command, id and arguments."""
+    cmd, msg_id, *args = message.split('\t')
+    return int(cmd), int(msg_id), args
+
+
+def is_reply(msg_id):
+    """Whether a received message answers a request of the client."""
+    return msg_id % 2 == 1
+
+
+def snap_line(filename, line_number):
+    """The line a breakpoint at line_number is set to.
+
+    Breakpoints only trigger on lines with code, the breakpoint is moved to
+    the next such line when the file is available locally.
+    """
+    if isinstance(line_number, int):
+        return source_cache.nearest_executable_line(filename, line_number)
+    return line_number
+
+
+def new_breakpoint(registry, filename='', line_number='', function=None,
+                   condition=None, expression=None, hit_count=None,
+                   ignore_count=None, log_message=None, _temporary=False):
+    """Register a breakpoint, returns it and the command to set it."""
+    line_number = snap_line(filename, line_number)
+
+    breakpoint_id = registry.allocate()
+    breakpoint = {
+        'id': breakpoint_id,
+        'filename': filename,
+        'line': line_number,
+        'function': function,
+        'condition': condition,
+        'expression': expression,
+        'hit_count': hit_count,
+        'ignore_count': ignore_count,
+        'log_message': log_message,
+        'temporary': _temporary,
+        'enabled': True
+    }
+    registry.add(breakpoint)
+    return breakpoint, set_break_command(breakpoint)
+
+
+def set_break_command(breakpoint):
+    """The command setting a breakpoint under its id."""
+    return (CMD_SET_BREAK, breakpoint['id'], *set_break_args(breakpoint))
+
+
+def remove_break_command(breakpoint):
+    """The command removing a breakpoint."""
+    return (CMD_REMOVE_BREAK, 'python-line', breakpoint['filename'],
+            breakpoint['id'])
+
+
+def update_breakpoint(registry, breakpoint_id, changes):
+    """Change a registered breakpoint, returns it and the command to set it
+    again."""
+    unknown = set(changes) - UPDATABLE_FIELDS
+    if unknown:
+        raise TypeError('Cannot update {}'.format(', '.join(unknown)))
+    try:
+        breakpoint = registry[breakpoint_id]
+    except KeyError:
+        raise RuntimeError(
+            'No breakpoint number {}'.format(breakpoint_id)) from None
+
+    breakpoint.update(changes)
+    return breakpoint, set_break_command(breakpoint)
+
+
+def temporary_breakpoint_hit(registry, stop_reason, frame):
+    """The temporary breakpoint a thread stopped at, or None."""
+    if stop_reason != str(CMD_SET_BREAK):
+        return None
+
+    # Find the breakpoint we had on that line
+    for breakpoint in registry.at(frame.file, frame.line):
+        if breakpoint['temporary']:
+            return breakpoint
+    return None
+
+
+def parse_version(args):
+    """The version of the server in the reply to CMD_VERSION."""
+    return urllib.parse.unquote(args[0])
+
+
+def parse_threads(payload, internal=True):
+    """Yield (id, name) of the threads in a thread list or thread create
+    payload. Without internal the threads of pydevd itself are left out."""
+    for node in iter_nodes(payload, ('thread',)):
+        if internal or node['name'] not in PYDEV_INTERNAL_THREADS:
+            yield node['id'], node['name']
+
+
+def parse_pid(payload):
+    """The PID of the debuggee, from the ids in a thread list payload."""
+    for node in iter_nodes(payload, ('thread',)):
+        return int(node['id'].split('_')[1])
+    return None
+
+
+def parse_suspend(payload):
+    """The suspended threads in a thread suspend payload.
+
+    Returns a list of (thread id, stop reason, frames), frames innermost
+    first.
+    """
+    return [
+        (node['id'], node.get('stop_reason'),
+         [Frame(f['id'], f['file'], int(f['line']), f['name'])
+          for f in frames])
+        for node, frames in iter_threads(payload)
+    ]
+
+
+def parse_value(payload):
+    """The value in the reply to CMD_EVALUATE_EXPRESSION."""
+    return next(iter_variables(payload))['value']
@@ -14,19 +14,45 @@
 """Implements the main command line interface. """
 
 import cmd
+import contextlib
 import functools
 import inspect
+import io
+import json
+import os
 import re
+import selectors
+import stat
 import sys
 import threading
 import time
-import select
 
-from .client import PyDevClient, State
+from .client import PyDevClient
+from .logpoints import file_sink
+from .sessions import SessionManager
+from .source import source_cache
+from .stats import DUMP_INTERVAL, StatsWriter
+from .store import BreakpointStore, default_store_path
+from .threads import State
 
 
 CONSOLE_PROMPT = '(pydevc) '
 
+# How long a stepping command waits for the debuggee to stop before the
+# prompt is printed.
+PROMPT_EVENT_TIMEOUT = 0.1
+
+# Commands that can be merged with the following command of the same kind in
+# scripts, mapped to the separator of their arguments.
+PIPELINED_COMMANDS = {
+    'break': ';',
+    'b': ';',
+    'delete': ' ',
+}
+
+# Length of local values printed for Emacs.
+LISP_LOCALS_VALUE_LENGTH = 80
+
 
 class ArgumentError(TypeError):
     """Raised when incorrect argument given to splitter."""
@@ -41,7 +67,8 @@ def split_args(*types, split_char=' '):
         def _wrapper(self, arg):
 
             s = inspect.signature(f)
-            defaults = [p.default for p in s.parameters.values()][1:]
+            params = list(s.parameters.values())[1:]
+            defaults = [p.default for p in params]
 
             if not arg:
                 args = []
@@ -50,15 +77,21 @@ def split_args(*types, split_char=' '):
             else:
                 args = [arg]
 
-            try:
-                for i, val in enumerate(args):
-                    defaults[i] = val
-            except IndexError:
-                raise ArgumentError('Too many arguments provided')
+            if params and params[-1].kind == inspect.Parameter.VAR_POSITIONAL:
+                # The function takes any number of arguments, but at least one
+                # has to be given.
+                if not args:
+                    raise ArgumentError('Wrong number of arguments')
+            else:
+                try:
+                    for i, val in enumerate(args):
+                        defaults[i] = val
+                except IndexError:
+                    raise ArgumentError('Too many arguments provided')
 
-            if inspect.Parameter.empty in defaults:
-                raise ArgumentError('Wrong number of arguments')
-            args = defaults
+                if inspect.Parameter.empty in defaults:
+                    raise ArgumentError('Wrong number of arguments')
+                args = defaults
 
             # Support split_args([type]) -notation for specifying variable
             # number of typed arguments.
@@ -72,7 +105,7 @@ def split_args(*types, split_char=' '):
             try:
                 typed_args = [t(s) if s is not None else None
                               for t, s in zip(_types, args)]
-            except TypeError as e:
+            except (TypeError, ValueError) as e:
                 raise ArgumentError(str(e)) from None
             return f(self, *typed_args)
         return _wrapper
@@ -87,13 +120,16 @@ def parse_breakpoint(s):
     - file.py:func_name
     """
 
-    match = re.compile(r'^([^:]+):(?:(\d+)|([^,]+))(?:, ?(.*))?$').match(s)
+    match = re.compile(r'^([^:]+):(?:(\d+)|([^,]+))(?:, ?(.*))?$') \
+              .match(s.strip())
+    if not match:
+        raise ValueError('Invalid breakpoint: {}'.format(s))
     filename = match.group(1)
-    lineno = int(match.group(2) or 'None')
+    lineno = int(match.group(2)) if match.group(2) else None
     scope = match.group(3) or 'None'
-    expression = match.group(4) or 'None'
+    condition = match.group(4) or None
 
-    return filename, lineno, scope, expression
+    return filename, lineno, scope, condition
 
 
 # pylint: disable=locally-disabled, too-many-public-methods
@@ -102,20 +138,61 @@ class DebuggerConsole(cmd.Cmd):
 
     def __init__(self, host, port, stdin=sys.stdin, stdout=sys.stdout,
                  autostart=False, filename=None, break_at_start=False,
-                 print_locals='off'):
+                 print_locals='off', sessions=None, breakpoint_store=None,
+                 logpoint_file=None, stats_file=None, stats_interval=None,
+                 trace_file=None):
         super().__init__(stdin=stdin, stdout=stdout)
-        self.session = PyDevClient(host, port)
 
-        self.session.callbacks = {
+        callbacks = {
             PyDevClient.EVENT_THREAD_SUSPEND: self.on_suspend,
+            PyDevClient.EVENT_FRAME_LOCALS: self.on_locals,
+            PyDevClient.EVENT_WATCHES: self.on_watches,
             PyDevClient.EVENT_SERVER_EXIT: self.on_exit,
             PyDevClient.EVENT_SET_BREAKPOINT: self.on_breakpoint_create,
             PyDevClient.EVENT_REMOVE_BREAKPOINT: self.on_breakpoint_remove,
+            PyDevClient.EVENT_SET_BREAKPOINTS: self.on_breakpoints_create,
+            PyDevClient.EVENT_REMOVE_BREAKPOINTS: self.on_breakpoints_remove,
         }
+
+        # With named sessions all of them are driven by a session manager,
+        # and self.session points to the currently selected one.
+        self.manager = None
+        self.sessions = sessions or []
+        if self.sessions:
+            self.manager = SessionManager()
+            self.manager.callbacks = {
+                key: self.__session_callback(callback)
+                for key, callback in callbacks.items()
+            }
+            self.session = None
+        else:
+            self.session = PyDevClient(host, port)
+            self.session.callbacks = callbacks
+
+            # Locals for Emacs are fetched in the background and printed
+            # when they arrive, without holding up the suspend message.
+            if print_locals == 'lisp':
+                self.session.prefetch_locals = True
+                self.session.locals_value_length = LISP_LOCALS_VALUE_LENGTH
+
+            # The traffic of the session can be recorded for replaying.
+            if trace_file:
+                self.session.start_trace(trace_file)
+
+        # Output of logpoints goes to the console, or to a file if given.
+        self.logpoint_sink = None
+        if logpoint_file:
+            self.logpoint_sink, self._logpoint_file = file_sink(logpoint_file)
+        if self.session is not None:
+            self.session.logpoints.add_sink(self.__logpoint_sink())
         self.prompt = CONSOLE_PROMPT
 
         self._prompt_lock = threading.Lock()
         self._prompt_sleeping = False
+        self._event_arrived = threading.Event()
+        self._wakeup = None
+        self._selector = None
+        self._input = b''
 
         self._quit = False
         self.filename = filename
@@ -124,8 +201,28 @@ class DebuggerConsole(cmd.Cmd):
 
         self.print_locals = print_locals
 
+        # Breakpoints are kept on disk and restored when the session starts.
+        self.store = (BreakpointStore(breakpoint_store) if breakpoint_store
+                      else None)
+
+        # Statistics of the sessions are dumped to a file periodically.
+        self.stats_writer = None
+        if stats_file:
+            self.stats_writer = StatsWriter(self.get_stats, stats_file,
+                                            stats_interval or DUMP_INTERVAL)
+
         self.opt_list_context = 7
 
+        # How long a script waits for the debuggee to stop, in seconds.
+        self.opt_wait_timeout = 30
+
+        # Scripts wait for every step to finish instead of returning to the
+        # prompt, the error and position of the current command are kept for
+        # the results.
+        self.batch = False
+        self._last_error = None
+        self._last_position = None
+
     def cmdloop(self, intro=None):
         """Repeatedly issue a prompt, accept input, parse an initial prefix
         off the received input, and dispatch to action methods, passing them
@@ -140,102 +237,305 @@ class DebuggerConsole(cmd.Cmd):
             self.stdout.write(str(self.intro) + "\n")
 
         self._quit = False
-        while not self._quit:
-
-            self.stdout.write(self.prompt)
-            self.stdout.flush()
+        try:
+            self.__open_selector()
             while not self._quit:
 
-                # Non-blocking user input with select
-                # NOTE: This does not support fancy input like with readline.
-                read, _write, _error = select.select([sys.stdin], [], [], 0.1)
-
-                if read:
-                    line = sys.stdin.readline()
-                    if not line:
-                        line = 'EOF'
-                    else:
-                        line = line.rstrip('\r\n')
+                self.stdout.write(self.prompt)
+                self.stdout.flush()
 
-                    line = self.precmd(line)
-                    self._quit = self.onecmd(line)
-                    self._quit = self.postcmd(self._quit, line)
+                line = self.__read_line()
+                if line is None:
                     break
+                if not line:
+                    line = 'EOF'
+                else:
+                    line = line.rstrip('\r\n')
+
+                line = self.precmd(line)
+                self._quit = self.onecmd(line)
+                self._quit = self.postcmd(self._quit, line)
+        finally:
+            self.__close_selector()
 
         self.postloop()
 
+    def __open_selector(self):
+        """Set up waiting on user input and on events from the debugger.
+
+        Events wake up the loop through a self-pipe, so the loop sleeps until
+        there is something to do.
+        """
+        self._input = b''
+        self._wakeup = os.pipe()
+        os.set_blocking(self._wakeup[1], False)
+
+        # Input redirected from a regular file cannot be registered with
+        # epoll, but select() handles it, reporting it always readable.
+        stdin = self.stdin.fileno()
+        if stat.S_ISREG(os.fstat(stdin).st_mode):
+            self._selector = selectors.SelectSelector()
+        else:
+            self._selector = selectors.DefaultSelector()
+        self._selector.register(stdin, selectors.EVENT_READ)
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+
+    def __close_selector(self):
+        selector, self._selector = self._selector, None
+        if selector is not None:
+            selector.close()
+        wakeup, self._wakeup = self._wakeup, None
+        for fd in wakeup or ():
+            os.close(fd)
+
+    def __wakeup(self):
+        """Wake up the input loop from another thread."""
+        try:
+            os.write(self._wakeup[1], b'\0')
+        except (TypeError, BlockingIOError, OSError):
+            # Not waiting for input, or a wakeup is already pending.
+            pass
+
+    def __read_line(self):
+        """Wait for a line of user input.
+
+        Like readline(), the line keeps its newline and is empty at the end
+        of input. Returns None if the console has been asked to quit while
+        waiting.
+        NOTE: This does not support fancy input like with readline.
+        """
+        stdin = self.stdin.fileno()
+        while b'\n' not in self._input:
+            if self._quit:
+                return None
+            for key, _events in self._selector.select():
+                if key.fileobj == self._wakeup[0]:
+                    os.read(self._wakeup[0], 512)
+                    continue
+                data = os.read(stdin, 4096)
+                if not data:
+                    line, self._input = self._input, b''
+                    return line.decode('utf-8', errors='replace')
+                self._input += data
+
+        end = self._input.index(b'\n') + 1
+        line, self._input = self._input[:end], self._input[end:]
+        return line.decode('utf-8', errors='replace')
+
     def postloop(self):
+        self.__close_outputs()
         self.stdout.write('Leaving\npydevc: That\'s all, folks...\n')
         self.stdout.flush()
 
-    def __prompt_sleep(self, t):
-        """Give the session t seconds to output async event.
-        If the event arrives during the wait time, no prompt will be printed
-        by the event.
+    def __close_outputs(self):
+        """Write out the stats and the trace of the session, if recorded."""
+        if self.stats_writer is not None:
+            self.stats_writer.close()
+        if self.manager is None:
+            self.session.stop_trace()
+
+    @contextlib.contextmanager
+    def __expect_event(self, timeout=PROMPT_EVENT_TIMEOUT):
+        """Give the session up to timeout seconds to output an async event.
+
+        Wraps a command that is expected to make the debuggee stop. If the
+        event arrives while waiting, it is printed without a prompt, and the
+        wait ends right away.
         """
+        if self.batch:
+            timeout = self.opt_wait_timeout
+        with self._prompt_lock:
+            sleeping, self._prompt_sleeping = self._prompt_sleeping, True
+            self._event_arrived.clear()
         try:
-            with self._prompt_lock:
-                self._prompt_sleeping = True
-            time.sleep(t)
+            yield
+            t0 = time.perf_counter()
+            self._event_arrived.wait(timeout)
+            if self.session is not None:
+                self.session.metrics.observe('prompt.wait',
+                                             time.perf_counter() - t0)
         finally:
             with self._prompt_lock:
-                self._prompt_sleeping = False
+                self._prompt_sleeping = sleeping
 
-    def on_suspend(self, filename, line_no, function):
-        """A thread stopped at a breakpoint.
+    def __progress(self, progress, thread):
+        """Let a thread run with the given session method.
+
+        Scripts wait until the thread stops again, or the debuggee exits.
         """
-        msg = '({}:{}): {}\n'.format(filename, line_no, function)
+        if not self.batch:
+            with self.__expect_event():
+                progress(thread)
+            return
+
+        # The thread is counted as stopped before the event is printed, wait
+        # for both so that the output belongs to this command.
+        try:
+            with self.__expect_event():
+                self._last_position = progress(thread, wait=True,
+                                               timeout=self.opt_wait_timeout)
+        except ConnectionError:
+            # The debuggee ran to the end, on_exit ends the script.
+            pass
 
-        if self.print_locals == 'lisp':
-            # Print the dictionary in lisp for so it can be easily parsed by
-            # Emacs.
-            l = ''
-            for name, props in self.session.get_locals().items():
-                l += '(%s "%s")' % (name, props['value'].replace('"', '\\"')[:80])
+    @staticmethod
+    def __session_callback(callback):
+        """Adapt a callback to the session manager, which passes the name of
+        the session as the first argument."""
+        def _callback(name, *args):
+            callback(*args, session=name)
+        return _callback
 
-            msg += '$$({})$$\n'.format(l)
+    @staticmethod
+    def __tag(session):
+        return '[{}] '.format(session) if session else ''
 
-        elif self.print_locals == 'table':
-            pass
+    def __print_async(self, msg, event=False):
+        """Print a message that arrived asynchronously.
 
-        # Asynchronous operation, print a new prompt after the message.
+        A new prompt follows the message unless a command is waiting for
+        it. With event, the waiting command is woken up.
+        """
         with self._prompt_lock:
             if self._prompt_sleeping:
                 self.stdout.write(msg)
             else:
                 self.stdout.write('\n{}{}'.format(msg, self.prompt))
+            self.stdout.flush()
+            if event:
+                self._event_arrived.set()
+
+    def on_suspend(self, filename, line_no, function, session=None):
+        """A thread stopped at a breakpoint.
+        """
+        msg = '{}({}:{}): {}\n'.format(self.__tag(session), filename, line_no,
+                                       function)
+        self.__print_async(msg, event=True)
+
+    def on_locals(self, _thread_id, _frame_id, frame_locals, session=None):
+        """Locals of a suspended frame have been fetched.
+        """
+        msg = self.__lisp_locals(frame_locals, session)
+        self.__print_async(msg)
 
-    def on_exit(self):
+    def on_watches(self, _thread_id, _frame_id, results, session=None):
+        """Watch expressions have been evaluated after a suspend.
+        """
+        msg = self.__format_watches(results, session)
+        self.__print_async(msg)
+
+    def __format_watches(self, results, session=None):
+        return ''.join('{}{}: {} = {}\n'.format(self.__tag(session), *result)
+                       for result in results)
+
+    def __logpoint_sink(self, session=None):
+        if self.logpoint_sink is not None:
+            return self.logpoint_sink
+        return functools.partial(self.on_log, session=session)
+
+    def on_log(self, records, session=None):
+        """Logpoints have written messages.
+        """
+        msg = ''.join('{}[logpoint {}] {}\n'.format(self.__tag(session),
+                                                    r.breakpoint_id, r.message)
+                      for r in records)
+        self.__print_async(msg)
+
+    def __lisp_locals(self, frame_locals, session=None):
+        # Print the dictionary in lisp for so it can be easily parsed by
+        # Emacs.
+        l = ''
+        for name, props in frame_locals.items():
+            l += '(%s "%s")' % (name, props['value'].replace('"', '\\"'))
+        return '{}$$({})$$\n'.format(self.__tag(session), l)
+
+    def on_exit(self, session=None):
         """The server has finished execution, the client is free to exit.
+
+        With multiple sessions the client exits once all of them are gone.
         """
+        if session is not None:
+            self.stdout.write('{}Session exited\n'.format(self.__tag(session)))
+            if self.manager.sessions:
+                return
         self._quit = True
+        self._event_arrived.set()
+        self.__wakeup()
 
-    def on_breakpoint_create(self, breakpoint):
+    def on_breakpoint_create(self, breakpoint, session=None):
         """Breakpoint was created.
         """
-        if not breakpoint['temporary']:
-            self.stdout.write('Breakpoint {id} set at line {line} of file'
-                              ' {filename}\n'.format(**breakpoint))
+        self.on_breakpoints_create([breakpoint], session=session)
 
-    def on_breakpoint_remove(self, breakpoint):
+    def on_breakpoint_remove(self, breakpoint, session=None):
         """Breakpoint was remove.
         """
-        if not breakpoint['temporary']:
-            self.stdout.write('Deleted breakpoint {id}\n'.format(**breakpoint))
+        self.on_breakpoints_remove([breakpoint], session=session)
+
+    def on_breakpoints_create(self, breakpoints, session=None):
+        """Breakpoints were created.
+        """
+        if self.store is not None:
+            for bp in breakpoints:
+                if not bp['temporary']:
+                    self.store.add(BreakpointStore.from_client(bp))
+
+        self.stdout.write(''.join(
+            '{}{} {id} set at line {line} of file {filename}\n'
+            .format(self.__tag(session),
+                    'Breakpoint' if bp.get('log_message') is None
+                    else 'Logpoint', **bp)
+            for bp in breakpoints if not bp['temporary']
+        ))
+
+    def on_breakpoints_remove(self, breakpoints, session=None):
+        """Breakpoints were removed.
+        """
+        if self.store is not None:
+            for bp in breakpoints:
+                if not bp['temporary']:
+                    self.store.remove(BreakpointStore.from_client(bp))
+
+        self.stdout.write(''.join(
+            '{}Deleted breakpoint {id}\n'.format(self.__tag(session), **bp)
+            for bp in breakpoints if not bp['temporary']
+        ))
 
     def onecmd(self, line):
+        # A command prefixed with @name is run against the named session
+        # without changing the selected one.
+        if line.startswith('@') and self.manager is not None:
+            name, _, line = line[1:].partition(' ')
+            selected = self.session
+            try:
+                self.session = self.manager.session(name)
+                return self.onecmd(line)
+            except RuntimeError as e:
+                self.stdout.write(str(e) + '\n')
+            finally:
+                self.session = selected
+
         try:
             return super().onecmd(line)
-        except RuntimeError as e:
+        except (RuntimeError, ArgumentError) as e:
+            self._last_error = str(e)
             self.stdout.write(str(e) + '\n')
 
     def preloop(self):
         """Connect to debugger process and initialize the session.
         """
+        if self.stats_writer is not None:
+            self.stats_writer.start()
+
+        if self.manager is not None:
+            self.__connect_sessions()
+            return
+
         self.session.connect()
         self.session.start()
 
         server_version = self.session.init('1.0')
+        self.__restore_breakpoints(self.session)
 
         if self.autostart:
             if self.filename and self.break_at_start:
@@ -243,6 +543,154 @@ class DebuggerConsole(cmd.Cmd):
 
         self.stdout.write('PyDev v{}\n'.format(server_version))
 
+    def run_script(self, lines, results=None):
+        """Run debugger commands without a prompt.
+
+        Connects to the debugger, runs the commands one after another and
+        returns a dict for each of them with the command, whether it
+        succeeded, its output, error and the position of the thread after
+        stepping. Results are also written to results as JSON lines, if
+        given. Blank lines and lines starting with # are skipped. Stepping
+        commands wait until the thread stops, up to opt_wait_timeout
+        seconds, and consecutive break and delete commands are sent in one
+        batch. The script ends early if the debuggee exits, and right after
+        the connection result if connecting fails.
+        """
+        # Output, including that of events, is collected for the results.
+        stdout, self.stdout = self.stdout, io.StringIO()
+        self.batch = True
+        self._prompt_sleeping = True
+        report = []
+
+        def _output():
+            with self._prompt_lock:
+                output = self.stdout.getvalue()
+                self.stdout.seek(0)
+                self.stdout.truncate()
+            return output
+
+        def _run(line, run):
+            self._last_error = None
+            self._last_position = None
+            t0 = time.perf_counter()
+            try:
+                run()
+            except (TimeoutError, ConnectionError) as e:
+                self._last_error = str(e)
+                self.stdout.write(str(e) + '\n')
+            elapsed = time.perf_counter() - t0
+
+            result = dict(command=line, ok=self._last_error is None,
+                          output=_output(), time=round(elapsed, 6))
+            if self._last_error is not None:
+                result['error'] = self._last_error
+            if self._last_position is not None:
+                result['position'] = dict(zip(('file', 'line', 'function'),
+                                              self._last_position))
+            report.append(result)
+            if results is not None:
+                results.write(json.dumps(result) + '\n')
+                results.flush()
+
+        def _onecmd(line):
+            self._quit = self.postcmd(self.onecmd(self.precmd(line)), line)
+
+        try:
+            _run(None, self.preloop)
+            if not report[0]['ok']:
+                # Not connected, none of the commands could run.
+                return report
+            for line in self.__pipeline(lines):
+                if self._quit:
+                    break
+                _run(line, functools.partial(_onecmd, line))
+        finally:
+            self.stdout = stdout
+            self.batch = False
+            self._prompt_sleeping = False
+            self.__close_outputs()
+        return report
+
+    @staticmethod
+    def __pipeline(lines):
+        """Merge runs of commands that can be sent in one batch."""
+        merged, separator = None, None
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            command, _, args = line.partition(' ')
+            if merged is not None:
+                if PIPELINED_COMMANDS.get(command) == separator and args:
+                    merged += separator + args
+                    continue
+                yield merged
+                merged = None
+
+            if command in PIPELINED_COMMANDS and args:
+                merged, separator = line, PIPELINED_COMMANDS[command]
+            else:
+                yield line
+
+        if merged is not None:
+            yield merged
+
+    def __restore_breakpoints(self, target):
+        """Set the breakpoints kept in the breakpoint store in one batch."""
+        if self.store is None:
+            return
+        breakpoints = self.store.load()
+        if breakpoints:
+            target.add_breakpoints(breakpoints)
+
+    def __connect_sessions(self):
+        """Connect to all named sessions and select the first one."""
+        self.manager.start()
+        for name, host, port in self.sessions:
+            server_version = self.manager.add_session(name, host, port)
+            self.manager.session(name).logpoints.add_sink(
+                self.__logpoint_sink(name))
+            self.stdout.write('{}PyDev v{}\n'.format(self.__tag(name),
+                                                     server_version))
+            if name == self.sessions[0][0]:
+                self.__restore_breakpoints(self.manager)
+
+            if self.autostart and self.filename and self.break_at_start:
+                self.manager.session(name).start_debugger(
+                    filename=self.filename)
+
+        self.session = self.manager.session(self.sessions[0][0])
+
+    @split_args(str)
+    def do_session(self, name=None):
+        """List sessions or select the active one.
+
+        Usage:
+            session [name]
+
+            name: Name of the session to select.
+
+        Any command can be run against a session without selecting it by
+        prefixing the command with @name, e.g. "@worker-2 locals".
+        """
+        if self.manager is None:
+            raise RuntimeError('Not running with named sessions')
+
+        if name is not None:
+            self.session = self.manager.session(name)
+            return
+
+        for session in self.manager.sessions:
+            position = self.manager.suspended.get(session)
+            fmt = '  {active} {name:<15} | {state}\n'.format(
+                active='*' if session == self.session.name else ' ',
+                name=session,
+                state=('SUSPENDED at {}:{}'.format(*position) if position
+                       else 'RUNNING')
+            )
+            self.stdout.write(fmt)
+
     @split_args()
     def do_start(self):
         """Start the debugger.
@@ -250,15 +698,15 @@ class DebuggerConsole(cmd.Cmd):
         Usage:
             start
         """
-        self.session.start_debugger()
-        self.__prompt_sleep(0.1)
+        with self.__expect_event():
+            self.session.start_debugger()
 
-    @split_args(parse_breakpoint)
-    def do_break(self, breakpoint):
-        """Add a breakpoint to the debugged program.
+    @split_args([parse_breakpoint], split_char=';')
+    def do_break(self, *breakpoints):
+        """Add breakpoint(s) to the debugged program.
 
         Usage:
-            break <filename>:(<lineno>|<scope>)[, <expression>]
+            break <filename>:(<lineno>|<scope>)[, <expression>][; ...]
 
             filename:   The name of the file where to insert breakpoint. Either
                         an absolute path or relative to debuggee's work
@@ -267,16 +715,98 @@ class DebuggerConsole(cmd.Cmd):
                         scope must be given.
             scope:      A scope qualifier (e.g. a function name) where to add
                         the breakpoint. Either lineno or scope must be given.
-            expression: Expression that will be evaluated when the breakpoint is
-                        hit. Only when the expression returns True the program
-                        will stop at the breakpoint.
-        """
-        filename, lineno, scope, expression = breakpoint
-        self.session.add_breakpoint(filename=filename, line_number=lineno,
-                                    function=scope, condition=None,
-                                    expression=expression)
+            expression: Condition that will be evaluated by the debuggee when
+                        the breakpoint is hit. Only when the expression
+                        returns True the program will stop at the breakpoint.
+
+        Many breakpoints can be given at once, separated by semicolons. With
+        named sessions the breakpoints are set to all of them.
+        """
+        target = self.manager or self.session
+        target.add_breakpoints([
+            dict(filename=filename, line_number=lineno, function=scope,
+                 condition=condition)
+            for filename, lineno, scope, condition in breakpoints
+        ])
     do_b = do_break
 
+    def do_log(self, arg):
+        """Add a logpoint, which logs a message without stopping.
+
+        Usage:
+            log <filename>:<lineno> <message>
+
+            message: Text to log each time the line is run. Expressions in
+                     braces are evaluated by the debuggee in the frame of the
+                     logpoint like in an f-string, so they can use its local
+                     variables, e.g. "request {request.path} took
+                     {elapsed:.3f}".
+
+        Logpoints are listed and deleted like breakpoints.
+        """
+        match = re.compile(r'^([^:]+):(\d+)\s+(.+)$').match(arg.strip())
+        if not match:
+            raise ArgumentError('Invalid logpoint: {}'.format(arg))
+
+        target = self.manager or self.session
+        target.add_breakpoints([
+            dict(filename=match.group(1), line_number=int(match.group(2)),
+                 log_message=match.group(3))
+        ])
+
+    def do_condition(self, arg):
+        """Set or remove the condition of a breakpoint.
+
+        Usage:
+            condition <id> [<expression>]
+
+            id:         The id of the breakpoint.
+            expression: The new condition, without it the breakpoint becomes
+                        unconditional.
+
+        With named sessions the breakpoint is changed in all of them.
+        """
+        breakpoint_id, _, condition = arg.strip().partition(' ')
+        try:
+            breakpoint_id = int(breakpoint_id)
+        except ValueError:
+            raise ArgumentError('Invalid breakpoint id: {}'.format(
+                breakpoint_id)) from None
+        self.__update_breakpoint(breakpoint_id,
+                                 condition=condition.strip() or None)
+
+    @split_args(int, int)
+    def do_ignore(self, breakpoint_id, count):
+        """Skip the next hits of a breakpoint.
+
+        Usage:
+            ignore <id> <count>
+
+            id:    The id of the breakpoint.
+            count: Number of times the breakpoint is passed before the program
+                   stops there. The hits are counted by the debuggee.
+
+        With named sessions the breakpoint is changed in all of them.
+        """
+        self.__update_breakpoint(breakpoint_id, ignore_count=count)
+
+    def __breakpoint_locations(self, ids):
+        """Locations of breakpoints of the selected session."""
+        missing = [i for i in ids if i not in self.session.breakpoints]
+        if missing:
+            raise RuntimeError('No breakpoint number {}'.format(missing[0]))
+        return [(self.session.breakpoints[i]['filename'],
+                 self.session.breakpoints[i]['line']) for i in ids]
+
+    def __update_breakpoint(self, breakpoint_id, **changes):
+        # Ids differ between sessions, the manager finds the breakpoint in
+        # each of them by its location.
+        if self.manager is None:
+            self.session.update_breakpoint(breakpoint_id, **changes)
+            return
+        location, = self.__breakpoint_locations([breakpoint_id])
+        self.manager.update_breakpoints(location, **changes)
+
     @split_args([int])
     def do_enable(self, *ids):
         """Enable breakpoint(s)
@@ -304,16 +834,21 @@ class DebuggerConsole(cmd.Cmd):
     do_d = do_disable
 
     @split_args([int])
-    def do_delete(self, ids):
+    def do_delete(self, *ids):
         """Delete breakpoint(s)
 
         Usage:
             delete <id1> <id2>...<idN>
 
             id:   The id of the breakpoint to delete.
+
+        With named sessions the breakpoints are deleted from all of them.
         """
-        for breakpoint_id in ids:
-            self.session.remove_breakpoint(breakpoint_id)
+        locations = self.__breakpoint_locations(ids)
+        if self.manager is None:
+            self.session.remove_breakpoints(ids)
+        else:
+            self.manager.remove_breakpoints(locations)
 
     @split_args(str)
     def do_step(self, thread=None):
@@ -327,8 +862,7 @@ class DebuggerConsole(cmd.Cmd):
             thread: Name or id of the thread to progress. Defaults to currently
                     active thread.
         """
-        self.session.step_into(thread)
-        self.__prompt_sleep(0.1)
+        self.__progress(self.session.step_into, thread)
 
     do_s = do_step
 
@@ -342,8 +876,7 @@ class DebuggerConsole(cmd.Cmd):
             thread: Name or id of the thread to progress. Defaults to currently
                     active thread.
         """
-        self.session.step_over(thread)
-        self.__prompt_sleep(0.1)
+        self.__progress(self.session.step_over, thread)
 
     do_n = do_next
 
@@ -357,8 +890,7 @@ class DebuggerConsole(cmd.Cmd):
             thread: Name or id of the thread to progress. Defaults to currently
                     active thread.
         """
-        self.session.step_return(thread)
-        self.__prompt_sleep(0.1)
+        self.__progress(self.session.step_return, thread)
 
     do_r = do_return
 
@@ -376,8 +908,7 @@ class DebuggerConsole(cmd.Cmd):
                     active thread.
         """
 
-        self.session.continue_thread(thread)
-        self.__prompt_sleep(0.1)
+        self.__progress(self.session.continue_thread, thread)
 
     do_c = do_continue
 
@@ -396,32 +927,44 @@ class DebuggerConsole(cmd.Cmd):
 
     do_j = do_jump
 
-    @split_args()
-    def do_up(self):
+    @split_args(int)
+    def do_up(self, count=1):
         """Go up a frame.
 
         Go up one stack frame, for example return from a function.
 
         Usage:
-            up
+            up [count]
 
-        The debugger has to be in a stopped state to go up a frame.
+        The debugger has to be in a stopped state to go up a frame. list, eval
+        and locals work on the selected frame.
         """
-        raise NotImplementedError('Command up not implemented')
+        self.__show_frame(self.session.frame_up(count=count))
 
-    @split_args()
-    def do_down(self):
+    @split_args(int)
+    def do_down(self, count=1):
         """Go down a frame.
 
         Go down one stack frame, for example go back to the called function
         after an exception has been caught.
 
         Usage:
-            up
+            down [count]
 
-        The debugger has to be in a stopped state to go up a frame.
+        The debugger has to be in a stopped state to go down a frame.
         """
-        raise NotImplementedError('Command down not implemented')
+        self.__show_frame(self.session.frame_down(count=count))
+
+    def __show_frame(self, frame):
+        """Print the position of a newly selected frame like a suspend."""
+        self.stdout.write('({}:{}): {}\n'.format(*frame.position))
+        if self.print_locals != 'lisp':
+            return
+
+        frame_locals = self.session.get_locals()
+        for props in frame_locals.values():
+            props['value'] = props['value'][:LISP_LOCALS_VALUE_LENGTH]
+        self.stdout.write(self.__lisp_locals(frame_locals))
 
     @split_args(str)
     def do_exec(self, expression):
@@ -449,6 +992,40 @@ class DebuggerConsole(cmd.Cmd):
 
     do_e = do_eval
 
+    def do_watch(self, expression):
+        """Watch an expression, or list the watches.
+
+        Usage:
+            watch [<expression>]
+
+        Watches are evaluated together every time a thread stops. Without an
+        expression the watches are listed with their values in the selected
+        frame.
+        """
+        expression = expression.strip()
+        if expression:
+            watch_id = self.session.add_watch(expression)
+            self.stdout.write('Watch {}: {}\n'.format(watch_id, expression))
+            return
+
+        try:
+            results = self.session.evaluate_watches()
+        except RuntimeError:
+            # Not stopped, there are no values to show.
+            results = [(watch_id, expression, '-') for watch_id, expression
+                       in self.session.watches.items()]
+        self.stdout.write(self.__format_watches(results))
+
+    @split_args([int])
+    def do_unwatch(self, *ids):
+        """Stop watching expressions.
+
+        Usage:
+            unwatch <id1> <id2>...<idN>
+        """
+        for watch_id in ids:
+            self.session.remove_watch(watch_id)
+
     @split_args()
     def do_locals(self):
         """Get values of local variables.
@@ -510,13 +1087,11 @@ class DebuggerConsole(cmd.Cmd):
         """
         filename, line_number, _function = self.session.get_position(thread)
 
-        with open(filename, 'rt', encoding='utf-8') as f:
-            lines = f.readlines()
-
         range_begin = max(0, line_number - self.opt_list_context)
         range_end = line_number + self.opt_list_context
-        for index, line in enumerate(lines[range_begin:range_end]):
-            _lineno = index + 1
+        lines = source_cache.lines(filename, range_begin + 1, range_end + 1)
+        for index, line in enumerate(lines):
+            _lineno = range_begin + index + 1
 
             linum_width = len(str(range_end + 1))
             fmt = ' {number:>{w}}  {current} {line}'.format(
@@ -537,12 +1112,49 @@ class DebuggerConsole(cmd.Cmd):
         Usage:
             exit
         """
-        self.session.kill_debugger()
+        if self.manager is None:
+            self.session.kill_debugger()
+            return True
+
+        for name in list(self.manager.sessions):
+            session = self.manager.session(name)
+            if session.pid is not None:
+                session.kill_debugger()
+        self.manager.close()
         return True
 
     do_quit = do_exit
     do_EOF = do_exit
 
+    def get_stats(self):
+        """Statistics of the session, or of every session by name."""
+        if self.manager is None:
+            return self.session.get_stats()
+        return {name: session.get_stats()
+                for name, session in list(self.manager.sessions.items())}
+
+    @split_args(str)
+    def do_stats(self, action=None):
+        """Show counters and latencies of the session.
+
+        Usage:
+            stats [reset|json]
+
+        Latencies are in milliseconds: rtt is the round trip of requests,
+        parse the time spent parsing replies and events, event and callback
+        the time spent handling events, queue the time events waited to be
+        handled and prompt the time the prompt waited for the debuggee.
+        """
+        if action == 'reset':
+            self.session.reset_stats()
+        elif action == 'json':
+            self.stdout.write(json.dumps(self.session.get_stats(),
+                                         sort_keys=True) + '\n')
+        elif action is None:
+            self.stdout.write(format_stats(self.session.get_stats()))
+        else:
+            raise RuntimeError('Unknown stats action: {}'.format(action))
+
     @split_args(str, str)
     def do_set(self, option, value):
         """Set debugger options.
@@ -565,15 +1177,16 @@ class DebuggerConsole(cmd.Cmd):
             thread [id]
         """
         # TODO: Check if the order stays the same between calls
-        for index, thread in enumerate(self.session.threads.values()):
+        threads = self.session.threads
+        for index, thread in enumerate(threads.values()):
             if index == thread_id:
-                self.session._active_thread = thread['id']
+                self.session.select_thread(thread.id)
             else:
                 fmt = '  {active} {id:<3} | {name:<15} | {running}\n'.format(
-                    active='*' if thread['id'] == self.session._active_thread else ' ',
+                    active='*' if thread.id == threads.active else ' ',
                     id=index,
-                    name=thread['name'],
-                    running=('SUSPENDED' if thread['state'] == State.SUSPENDED else 'RUNNING')
+                    name=str(thread.name),
+                    running=('SUSPENDED' if thread.state == State.SUSPENDED else 'RUNNING')
                 )
                 self.stdout.write(fmt)
 
@@ -582,14 +1195,72 @@ class DebuggerConsole(cmd.Cmd):
     def emptyline(self):
         pass
 
+    def default(self, line):
+        self._last_error = 'Unknown command: {}'.format(line)
+        super().default(line)
+
+
+def format_stats(stats):
+    """Format a snapshot of PyDevClient.get_stats as a table."""
+    gauges = stats['gauges']
+    lines = [
+        'Uptime {:.1f} s, {} threads ({} suspended), {} pending replies, '
+        '{} queued events'.format(stats['uptime'], gauges['threads'],
+                                  gauges['suspended_threads'],
+                                  gauges['pending_replies'],
+                                  gauges['event_backlog']),
+        'Sent {} messages ({} bytes), received {} messages ({} bytes)'.format(
+            gauges['messages_sent'], gauges['bytes_sent'],
+            gauges['messages_received'], gauges['bytes_received']),
+        '',
+    ]
+
+    width = max([len(name) for name in stats['counters']] +
+                [len(name) for name in stats['latency']] + [12])
+    for name, count in sorted(stats['counters'].items()):
+        lines.append('{:<{w}}  {:>8}'.format(name, count, w=width))
+
+    if stats['latency']:
+        lines.append('')
+        lines.append('{:<{w}}  {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+            'latency (ms)', 'count', 'mean', 'p50', 'p95', 'max', w=width))
+    for name, latency in stats['latency'].items():
+        lines.append('{:<{w}}  {:>8}{}'.format(
+            name, latency['count'],
+            ''.join(' {:>9.3f}'.format(latency[key] * 1000)
+                    for key in ('mean', 'p50', 'p95', 'max')),
+            w=width))
+    return '\n'.join(lines) + '\n'
+
 
 def run_repl(options):
     """Start the REPL.
     """
+    if options.no_breakpoint_store:
+        store = None
+    elif options.breakpoint_store:
+        store = options.breakpoint_store
+    else:
+        project_dir = os.path.dirname(os.path.abspath(options.file)) \
+            if options.file else os.getcwd()
+        store = default_store_path(project_dir)
 
     c = DebuggerConsole(host=options.server, port=options.port,
                         autostart=options.autostart,
                         filename=options.file,
                         break_at_start=options.break_at_start,
-                        print_locals=options.print_locals)
+                        print_locals=options.print_locals,
+                        sessions=options.sessions,
+                        breakpoint_store=store,
+                        logpoint_file=options.logpoint_file,
+                        stats_file=options.stats_file,
+                        stats_interval=options.stats_interval,
+                        trace_file=options.trace)
+
+    if options.script:
+        with open(options.script) as f:
+            report = c.run_script(f, results=sys.stdout)
+        return 0 if all(result['ok'] for result in report) else 1
+
     c.cmdloop()
+    return 0
@@ -0,0 +1,251 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Manages many simultaneous debug sessions.
+
+All sessions share one asyncio event loop running in a single background
+thread, so the cost of a session is a socket and a couple of tasks instead of
+OS threads.
+"""
+
+import asyncio
+import collections
+import functools
+import inspect
+import logging
+import threading
+
+from .aio import AsyncPyDevClient
+from .protocol import snap_line
+
+
+logger = logging.getLogger(__name__)
+
+
+class SessionProxy:
+    """Blocking facade for an AsyncPyDevClient running on the manager's loop.
+
+    Coroutine methods of the client are run on the loop and waited for,
+    everything else is passed through, so the proxy can stand in for a
+    PyDevClient.
+    """
+
+    def __init__(self, manager, name, client):
+        self.manager = manager
+        self.name = name
+        self.client = client
+
+    def __getattr__(self, attr):
+        value = getattr(self.client, attr)
+        if not inspect.iscoroutinefunction(value):
+            return value
+
+        @functools.wraps(value)
+        def _blocking(*args, **kwargs):
+            return self.manager.call(value(*args, **kwargs))
+        return _blocking
+
+    def __setattr__(self, attr, value):
+        if attr in ('manager', 'name', 'client'):
+            super().__setattr__(attr, value)
+        else:
+            setattr(self.client, attr, value)
+
+
+class SessionManager:
+    """Keep connections to many pydevd processes over one I/O loop.
+
+    Callbacks receive the name of the session as their first argument,
+    followed by the arguments of the corresponding PyDevClient callback.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        daemon=True)
+
+        self.sessions = collections.OrderedDict()
+        self.callbacks = {}
+
+        # Breakpoints that have been fanned out, replayed to new sessions.
+        self.breakpoints = []
+
+        # Latest position of each suspended session.
+        self.suspended = collections.OrderedDict()
+
+    def start(self):
+        """Start the I/O thread."""
+        self._thread.start()
+
+    def call(self, coro, timeout=None):
+        """Run a coroutine on the I/O loop and wait for its result."""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError('Cannot block the session I/O loop')
+        return asyncio.run_coroutine_threadsafe(coro, self.loop) \
+                      .result(timeout)
+
+    def __run_callback(self, key, *args):
+        if key in self.callbacks:
+            try:
+                self.callbacks[key](*args)
+            except Exception:  # pylint: disable=locally-disabled, broad-except
+                logger.exception('Callback for %s failed', key)
+
+    async def __pump(self, name, client):
+        """Forward events of one session to the aggregated callbacks."""
+        async for event, *args in client.events():
+            if event == AsyncPyDevClient.EVENT_THREAD_SUSPEND:
+                self.suspended[name] = tuple(args)
+            elif event == AsyncPyDevClient.EVENT_SERVER_EXIT:
+                self.suspended.pop(name, None)
+                self.sessions.pop(name, None)
+            with client.metrics.timed('callback.' + event):
+                self.__run_callback(event, name, *args)
+
+    async def __add_session(self, name, host, port, version, timeout):
+        client = AsyncPyDevClient(host, port)
+        await client.connect(timeout)
+        server_version = await client.init(version)
+        if self.breakpoints:
+            await client.add_breakpoints(self.breakpoints)
+        self.sessions[name] = client
+        self.loop.create_task(self.__pump(name, client))
+        return server_version
+
+    def add_session(self, name, host, port, version='1.0', timeout=5):
+        """Connect to a pydevd process and register it under name.
+
+        Breakpoints previously set through the manager are set to the new
+        session as well. Returns the version of the server.
+        """
+        if name in self.sessions:
+            raise RuntimeError('Session already exists: {}'.format(name))
+        return self.call(self.__add_session(name, host, port, version,
+                                            timeout))
+
+    async def __remove_session(self, name):
+        client = self.sessions.pop(name)
+        self.suspended.pop(name, None)
+        await client.close()
+
+    def remove_session(self, name):
+        """Disconnect from a session."""
+        self.call(self.__remove_session(name))
+
+    def session(self, name):
+        """Get a blocking proxy for the named session."""
+        try:
+            return SessionProxy(self, name, self.sessions[name])
+        except KeyError:
+            raise RuntimeError('Unknown session: {}'.format(name)) from None
+
+    async def __each_session(self, func, *args):
+        names = list(self.sessions)
+        results = await asyncio.gather(*[
+            func(self.sessions[name], *args) for name in names
+        ])
+        return dict(zip(names, results))
+
+    async def __fan_out(self, method, *args, **kwargs):
+        return await self.__each_session(
+            lambda client: getattr(client, method)(*args, **kwargs))
+
+    @staticmethod
+    def __ids_at(client, locations):
+        # Temporary breakpoints belong to the session that set them.
+        return [bp['id'] for filename, line in locations
+                for bp in client.breakpoints.at(filename, line)
+                if not bp['temporary']]
+
+    @staticmethod
+    def __snapped(kwargs):
+        # Kept with the line the clients move the breakpoint to, so that it
+        # is found by the location they report.
+        kwargs = dict(kwargs)
+        if 'line_number' in kwargs:
+            kwargs['line_number'] = snap_line(kwargs.get('filename', ''),
+                                              kwargs['line_number'])
+        return kwargs
+
+    @staticmethod
+    def __location(breakpoint):
+        return breakpoint.get('filename', ''), \
+            str(breakpoint.get('line_number', ''))
+
+    def add_breakpoint(self, **kwargs):
+        """Set a breakpoint to all sessions.
+
+        Takes the arguments of PyDevClient.add_breakpoint and returns the id of
+        the breakpoint in each session, keyed by session name.
+        """
+        kwargs = self.__snapped(kwargs)
+        self.breakpoints.append(kwargs)
+        return self.call(self.__fan_out('add_breakpoint', **kwargs))
+
+    def add_breakpoints(self, breakpoints):
+        """Set many breakpoints to all sessions with one write per session.
+
+        Returns the ids of the breakpoints in each session, keyed by session
+        name.
+        """
+        breakpoints = [self.__snapped(kwargs) for kwargs in breakpoints]
+        self.breakpoints.extend(breakpoints)
+        return self.call(self.__fan_out('add_breakpoints', breakpoints))
+
+    async def __remove_at(self, client, locations):
+        ids = self.__ids_at(client, locations)
+        if ids:
+            await client.remove_breakpoints(ids)
+        return ids
+
+    def remove_breakpoints(self, locations):
+        """Remove the breakpoints at (filename, line) locations from all
+        sessions.
+
+        Ids differ between sessions, so breakpoints are matched by location.
+        Returns the ids of the removed breakpoints in each session, keyed by
+        session name.
+        """
+        locations = {(filename, str(line)) for filename, line in locations}
+        self.breakpoints = [kwargs for kwargs in self.breakpoints
+                            if self.__location(kwargs) not in locations]
+        return self.call(self.__each_session(self.__remove_at, locations))
+
+    async def __update_at(self, client, location, changes):
+        ids = self.__ids_at(client, [location])
+        for breakpoint_id in ids:
+            await client.update_breakpoint(breakpoint_id, **changes)
+        return ids
+
+    def update_breakpoints(self, location, **changes):
+        """Change the breakpoints at a (filename, line) location in all
+        sessions.
+
+        Takes the changes of PyDevClient.update_breakpoint and returns the ids
+        of the changed breakpoints in each session, keyed by session name.
+        """
+        filename, line = location
+        location = (filename, str(line))
+        for kwargs in self.breakpoints:
+            if self.__location(kwargs) == location:
+                kwargs.update(changes)
+        return self.call(self.__each_session(self.__update_at, location,
+                                             changes))
+
+    def close(self):
+        """Disconnect all sessions and stop the I/O thread."""
+        for name in list(self.sessions):
+            self.remove_session(name)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
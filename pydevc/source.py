@@ -0,0 +1,220 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Cached, memory-mapped access to the source files being debugged."""
+
+import bisect
+import collections
+import dis
+import io
+import mmap
+import os
+import threading
+import tokenize
+
+
+# Total size of the files kept mapped by the default cache.
+SOURCE_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class SourceFile:
+    """A source file mapped to memory.
+
+    Line offsets are indexed lazily, only as far as the lines that have been
+    requested, so reading a window of lines does not decode the whole file.
+    The file is unmapped when the object is garbage collected.
+    """
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+
+        if self.size:
+            with open(path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b''
+
+        # Start offsets of the lines indexed so far, offsets[0] is line 1.
+        self.offsets = [0]
+        self.complete = self.size == 0
+
+        self._code = None
+        self._executable_lines = None
+
+    def __index_to(self, line_number):
+        """Index line offsets up to and including the given line."""
+        offsets = self.offsets
+        while not self.complete and len(offsets) <= line_number:
+            newline = self.data.find(b'\n', offsets[-1])
+            if newline < 0 or newline + 1 == self.size:
+                self.complete = True
+            else:
+                offsets.append(newline + 1)
+
+    def line_count(self):
+        """Number of lines in the file."""
+        self.__index_to(float('inf'))
+        return len(self.offsets) if self.size else 0
+
+    def lines(self, start=1, end=None):
+        """Get lines start..end (1-based, end exclusive) with line endings.
+        """
+        if end is None:
+            self.__index_to(float('inf'))
+            end = len(self.offsets) + 1
+        else:
+            self.__index_to(end)
+
+        start = max(start, 1)
+        end = min(end, len(self.offsets) + 1)
+        if start >= end or not self.size:
+            return []
+
+        begin = self.offsets[start - 1]
+        stop = self.offsets[end - 1] if end - 1 < len(self.offsets) \
+            else self.size
+        text = self.data[begin:stop].decode('utf-8', errors='replace')
+        return text.splitlines(keepends=True)
+
+    def __compile(self):
+        """Compile the module, None if it is not valid Python."""
+        if self._code is None:
+            try:
+                # Compiling from bytes honours encoding cookies and BOMs.
+                self._code = compile(self.data[:], self.path, 'exec',
+                                     dont_inherit=True)
+            except (SyntaxError, ValueError):
+                self._code = False
+        return self._code or None
+
+    def executable_lines(self):
+        """Sorted line numbers that can hold a breakpoint.
+
+        These are the lines for which the interpreter emits line events,
+        collected from the module and all the functions and classes in it.
+        Empty if the file can not be compiled.
+        """
+        if self._executable_lines is None:
+            lines = set()
+            code = self.__compile()
+            pending = [code] if code is not None else []
+            while pending:
+                code = pending.pop()
+                lines.update(_code_lines(code))
+                pending.extend(c for c in code.co_consts
+                               if isinstance(c, type(code)))
+            self._executable_lines = sorted(lines)
+        return self._executable_lines
+
+    def nearest_executable_line(self, line_number):
+        """Get the first executable line at or after line_number.
+
+        Falls back to the last executable line before it, and to line_number
+        itself if nothing is known about the file.
+        """
+        lines = self.executable_lines()
+        if not lines:
+            return line_number
+        index = bisect.bisect_left(lines, line_number)
+        return lines[index] if index < len(lines) else lines[-1]
+
+    def first_statement(self):
+        """Line number of the first statement that accepts a breakpoint.
+
+        That is the first line the module code emits a line event for. If the
+        file can not be compiled, it is the first line holding a token other
+        than a comment.
+        """
+        code = self.__compile()
+        if code is not None:
+            lines = _code_lines(code)
+            return min(lines) if lines else None
+
+        readline = io.BytesIO(self.data[:]).readline
+        try:
+            for token in tokenize.tokenize(readline):
+                if token.type not in (tokenize.ENCODING, tokenize.COMMENT,
+                                      tokenize.NL, tokenize.NEWLINE,
+                                      tokenize.INDENT, tokenize.DEDENT):
+                    return token.start[0] if token.string else None
+        except (tokenize.TokenError, SyntaxError):
+            pass
+        return None
+
+
+def _code_lines(code):
+    """Line numbers of the instructions of a single code object."""
+    if hasattr(code, 'co_lines'):
+        return {line for _start, _end, line in code.co_lines() if line}
+    return {line for _offset, line in dis.findlinestarts(code) if line}
+
+
+class SourceCache:
+    """Source files by path, validated by modification time and size.
+
+    Files are evicted least recently used first once the total size of the
+    mapped files exceeds max_size.
+    """
+
+    def __init__(self, max_size=SOURCE_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.files = collections.OrderedDict()
+        self.total_size = 0
+
+    def get(self, path):
+        """Get an up-to-date SourceFile for the path."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+
+        with self.lock:
+            source = self.files.get(path)
+            if source is not None:
+                if (source.mtime, source.size) == (stat.st_mtime_ns,
+                                                   stat.st_size):
+                    self.files.move_to_end(path)
+                    return source
+                self.__evict(path)
+
+            source = SourceFile(path, stat)
+            self.files[path] = source
+            self.total_size += source.size
+
+            while self.total_size > self.max_size and len(self.files) > 1:
+                self.__evict(next(iter(self.files)))
+            return source
+
+    def __evict(self, path):
+        source = self.files.pop(path)
+        self.total_size -= source.size
+        # Not closed, another thread may still be reading the file. The map
+        # is released along with its last reference.
+
+    def lines(self, path, start=1, end=None):
+        """Get lines start..end (1-based, end exclusive) of a file."""
+        return self.get(path).lines(start, end)
+
+    def nearest_executable_line(self, path, line_number):
+        """Snap a line to the nearest line that can hold a breakpoint.
+
+        The line is returned as it is if the file can not be read locally.
+        """
+        try:
+            return self.get(path).nearest_executable_line(line_number)
+        except OSError:
+            return line_number
+
+
+source_cache = SourceCache()
@@ -0,0 +1,232 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Counters and latency histograms of a debugger connection.
+
+Every client keeps a Metrics object, updated on the hot paths: messages sent
+per command, the round trip of requests, the time spent parsing payloads,
+waiting in the event queue, handling events and running callbacks. A snapshot
+tells whether time goes to pydevd, the network or the client itself.
+"""
+
+import bisect
+import collections
+import json
+import logging
+import threading
+import time
+
+from _pydevd_bundle.pydevd_comm import ID_TO_MEANING
+
+# Upper bounds of the latency buckets in seconds, doubling from 10 us to about
+# 40 s. Slower samples fall into an extra, unbounded bucket.
+LATENCY_BUCKETS = tuple(1e-5 * 2 ** i for i in range(23))
+
+# Latency samples queued before they are added to the histograms.
+MAX_PENDING_SAMPLES = 1024
+
+# Seconds between two snapshots written by StatsWriter.
+DUMP_INTERVAL = 10
+
+logger = logging.getLogger(__name__)
+
+COMMAND_NAMES = {int(cmd): name for cmd, name in ID_TO_MEANING.items()}
+
+
+def command_name(cmd):
+    """Name of a pydevd command id, e.g. CMD_THREAD_SUSPEND."""
+    name = COMMAND_NAMES.get(cmd)
+    if name is None:
+        name = COMMAND_NAMES[cmd] = 'CMD_{}'.format(cmd)
+    return name
+
+
+class Histogram:
+    """Distribution of latencies in exponential buckets."""
+
+    __slots__ = ('buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p:th percentile."""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                if index < len(LATENCY_BUCKETS):
+                    return min(LATENCY_BUCKETS[index], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max if self.count else None,
+        }
+
+
+class Metrics:
+    """Counters and latency histograms by name, safe to update from any
+    thread.
+
+    Names are dotted, the first part tells the kind of the measurement, e.g.
+    'sent.CMD_STEP_OVER' or 'rtt.CMD_GET_FRAME'.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.samples = collections.deque()
+        self.started = time.time()
+
+    def count(self, name, n=1):
+        """Increment a counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        """Add a latency sample.
+
+        Samples are only appended to a queue, which is atomic, and sorted
+        into the histograms in batches, keeping the hot paths free of locks.
+        """
+        self.samples.append((name, seconds))
+        if len(self.samples) >= MAX_PENDING_SAMPLES:
+            self.__collect()
+
+    def __collect(self):
+        with self.lock:
+            histograms = self.histograms
+            pop = self.samples.popleft
+            for _ in range(len(self.samples)):
+                name, seconds = pop()
+                histogram = histograms.get(name)
+                if histogram is None:
+                    histogram = histograms[name] = Histogram()
+                histogram.add(seconds)
+
+    def timed(self, name):
+        """Context manager measuring the time spent in the block."""
+        return _Timer(self, name)
+
+    def reset(self):
+        """Forget everything measured so far."""
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.samples.clear()
+            self.started = time.time()
+
+    def snapshot(self, **gauges):
+        """Current values as a JSON serializable dict.
+
+        Gauges are values owned by the caller, like the number of threads,
+        and are included as they are.
+        """
+        self.__collect()
+        with self.lock:
+            return {
+                'time': time.time(),
+                'uptime': time.time() - self.started,
+                'counters': dict(self.counters),
+                'latency': {name: histogram.to_dict() for name, histogram
+                            in sorted(self.histograms.items())},
+                'gauges': gauges,
+            }
+
+
+class _Timer:
+    """Add the duration of a with block to a histogram.
+
+    A plain class instead of contextlib.contextmanager, as timers wrap every
+    event and callback.
+    """
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class StatsWriter:
+    """Append a snapshot to a file as a JSON line every interval seconds.
+
+    The snapshot is whatever the given function returns, and a final one is
+    written when the writer is closed.
+    """
+
+    def __init__(self, snapshot, path, interval=DUMP_INTERVAL):
+        self.snapshot = snapshot
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self):
+        """Start writing snapshots."""
+        self.thread.start()
+
+    def close(self):
+        """Write the last snapshot and stop."""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def write(self):
+        """Write a snapshot right away."""
+        try:
+            line = json.dumps(self.snapshot(), sort_keys=True)
+            with open(self.path, 'at', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning('Could not write stats: %s', e)
+
+    def __run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+        self.write()
@@ -0,0 +1,142 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Persistent storage of breakpoints between debugging sessions."""
+
+import hashlib
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+def default_store_path(project_dir):
+    """Get the path of the breakpoint log of a project.
+
+    Logs are kept under $XDG_DATA_HOME/pydevc, named after the absolute path
+    of the project directory.
+    """
+    data_home = os.environ.get('XDG_DATA_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.local', 'share')
+    project = os.path.abspath(project_dir)
+    digest = hashlib.sha1(project.encode('utf-8')).hexdigest()[:16]
+    name = '{}-{}.log'.format(os.path.basename(project) or 'root', digest)
+    return os.path.join(data_home, 'pydevc', 'breakpoints', name)
+
+
+class BreakpointStore:
+    """Breakpoints of a project, kept in an append-only log.
+
+    Every change appends one JSON line to the log, either
+    {"op": "add", "breakpoint": {...}} or {"op": "remove", "breakpoint": {...}}
+    where the breakpoint holds the arguments of PyDevClient.add_breakpoint.
+    Breakpoints are identified by their location and whether they are
+    logpoints, so a breakpoint and a logpoint can share a line. The log is
+    compacted when it is loaded.
+    """
+
+    FIELDS = ('filename', 'line_number', 'function', 'condition', 'expression',
+              'hit_count', 'ignore_count', 'log_message')
+
+    def __init__(self, path):
+        self.path = path
+        self.breakpoints = {}
+
+    @classmethod
+    def _key(cls, breakpoint):
+        return (breakpoint['filename'], breakpoint['line_number'],
+                breakpoint.get('function'),
+                breakpoint.get('log_message') is not None)
+
+    @classmethod
+    def from_client(cls, breakpoint):
+        """Convert a breakpoint of PyDevClient to add_breakpoint arguments."""
+        return {
+            'filename': breakpoint['filename'],
+            'line_number': breakpoint['line'],
+            'function': breakpoint.get('function'),
+            'condition': breakpoint.get('condition'),
+            'expression': breakpoint.get('expression'),
+            'hit_count': breakpoint.get('hit_count'),
+            'ignore_count': breakpoint.get('ignore_count'),
+            'log_message': breakpoint.get('log_message'),
+        }
+
+    def load(self):
+        """Read the log, returns the stored breakpoints.
+
+        The result can be passed to PyDevClient.add_breakpoints.
+        """
+        self.breakpoints = {}
+        records = 0
+        try:
+            with open(self.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        breakpoint = {k: record['breakpoint'].get(k)
+                                      for k in self.FIELDS}
+                        key = self._key(breakpoint)
+                    except (ValueError, KeyError, TypeError):
+                        # A partially written last line, skip it.
+                        logger.debug('Skipping corrupt record: %r', line)
+                        continue
+                    records += 1
+                    if record.get('op') == 'remove':
+                        self.breakpoints.pop(key, None)
+                    else:
+                        self.breakpoints[key] = breakpoint
+        except FileNotFoundError:
+            return []
+
+        if records > len(self.breakpoints):
+            self.compact()
+        return list(self.breakpoints.values())
+
+    def compact(self):
+        """Rewrite the log with only the current breakpoints."""
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'wt', encoding='utf-8') as f:
+                for breakpoint in self.breakpoints.values():
+                    f.write(self.__record('add', breakpoint))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning('Could not compact breakpoint store: %s', e)
+
+    @staticmethod
+    def __record(op, breakpoint):
+        return json.dumps({'op': op, 'breakpoint': breakpoint}) + '\n'
+
+    def __append(self, op, breakpoint):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'at', encoding='utf-8') as f:
+                f.write(self.__record(op, breakpoint))
+        except OSError as e:
+            logger.warning('Could not write breakpoint store: %s', e)
+
+    def add(self, breakpoint):
+        """Store a breakpoint given as add_breakpoint arguments."""
+        key = self._key(breakpoint)
+        if self.breakpoints.get(key) == breakpoint:
+            return
+        self.breakpoints[key] = breakpoint
+        self.__append('add', breakpoint)
+
+    def remove(self, breakpoint):
+        """Forget a breakpoint given as add_breakpoint arguments."""
+        if self.breakpoints.pop(self._key(breakpoint), None) is not None:
+            self.__append('remove', breakpoint)
@@ -0,0 +1,215 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""State of the threads of the debugged process."""
+
+import enum
+import threading
+
+
+class State(enum.Enum):
+    RUNNING = 0
+    SUSPENDED = 1
+
+
+class Frame:
+    """A frame on the stack of a suspended thread."""
+
+    __slots__ = ('id', 'file', 'line', 'function')
+
+    def __init__(self, frame_id, file, line, function):
+        self.id = frame_id
+        self.file = file
+        self.line = line
+        self.function = function
+
+    @property
+    def position(self):
+        return self.file, self.line, self.function
+
+    def __repr__(self):
+        return '<Frame {} {}:{} {}>'.format(self.id, *self.position)
+
+
+class ThreadState:
+    """A thread of the debuggee and, while it is suspended, its stack.
+
+    Frames are listed innermost first. The stack arrives whole with the
+    suspend, so moving between frames needs no round trip. The selected
+    frame is where the thread is inspected, it is reset to the innermost
+    frame on every suspend.
+    """
+
+    __slots__ = ('id', 'name', 'state', 'frames', 'selected', 'stop_reason')
+
+    def __init__(self, thread_id, name=None):
+        self.id = thread_id
+        self.name = name
+        self.state = State.RUNNING
+        self.frames = []
+        self.selected = 0
+        self.stop_reason = None
+
+    @property
+    def suspended(self):
+        return self.state == State.SUSPENDED
+
+    @property
+    def frame(self):
+        """The selected frame."""
+        if not self.suspended or not self.frames:
+            raise RuntimeError('No active frame')
+        return self.frames[self.selected]
+
+    @property
+    def position(self):
+        """File, line and function of the selected frame."""
+        if not self.suspended or not self.frames:
+            raise RuntimeError('Cannot get position of running thread.')
+        return self.frames[self.selected].position
+
+    def select_frame(self, index):
+        """Select a frame by its index, 0 being the innermost one."""
+        if not self.suspended or not self.frames:
+            raise RuntimeError('No active frame')
+        if index < 0:
+            raise RuntimeError('Newest frame')
+        if index >= len(self.frames):
+            raise RuntimeError('Oldest frame')
+        self.selected = index
+        return self.frames[index]
+
+    def __repr__(self):
+        return '<ThreadState {} {!r} {}>'.format(self.id, self.name,
+                                                 self.state.name)
+
+
+class ThreadTable:
+    """Threads of the debuggee indexed by id and by name.
+
+    All updates and lookups are O(1). Many threads can share a name, a name
+    then refers to the one that was created first. One thread is the active
+    one, used by commands that are not given a thread: the thread that
+    suspended last, or the one selected with select().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._by_id = {}
+        self._by_name = {}
+        self.active = None
+
+    def __getitem__(self, thread_id):
+        return self._by_id[thread_id]
+
+    def __contains__(self, thread_id):
+        return thread_id in self._by_id
+
+    def __iter__(self):
+        return iter(list(self._by_id))
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def values(self):
+        return list(self._by_id.values())
+
+    def get(self, thread_id, default=None):
+        return self._by_id.get(thread_id, default)
+
+    def __add(self, thread_id, name):
+        thread = self._by_id.get(thread_id)
+        if thread is None:
+            thread = self._by_id[thread_id] = ThreadState(thread_id)
+        if name is not None and name != thread.name:
+            self.__unindex(thread)
+            thread.name = name
+            self._by_name.setdefault(name, {})[thread_id] = thread
+        if self.active is None:
+            self.active = thread_id
+        return thread
+
+    def __unindex(self, thread):
+        named = self._by_name.get(thread.name)
+        if named is not None:
+            named.pop(thread.id, None)
+            if not named:
+                del self._by_name[thread.name]
+
+    def create(self, thread_id, name=None):
+        """Register a thread, or update the name of a known thread."""
+        with self.lock:
+            return self.__add(thread_id, name)
+
+    def kill(self, thread_id):
+        """Forget a thread, returns it or None if it was not known."""
+        with self.lock:
+            thread = self._by_id.pop(thread_id, None)
+            if thread is None:
+                return None
+            self.__unindex(thread)
+            if self.active == thread_id:
+                # Just pick the first available thread as the active one.
+                self.active = next(iter(self._by_id), None)
+        thread.state = State.RUNNING
+        thread.frames = []
+        return thread
+
+    def suspend(self, thread_id, frames, stop_reason=None):
+        """Mark a thread suspended with the given stack and make it active."""
+        with self.lock:
+            thread = self.__add(thread_id, None)
+            thread.frames = frames
+            thread.selected = 0
+            thread.stop_reason = stop_reason
+            thread.state = State.SUSPENDED
+            self.active = thread_id
+        return thread
+
+    def resume(self, thread_id):
+        """Mark a thread running, its stack is no longer valid."""
+        thread = self._by_id[thread_id]
+        thread.state = State.RUNNING
+        thread.frames = []
+        thread.selected = 0
+        return thread
+
+    def select(self, thread):
+        """Make the given thread, by id or name, the active one."""
+        thread_id = self.resolve(thread)
+        self.active = thread_id
+        return thread_id
+
+    def active_frame(self):
+        """The active thread and its selected frame."""
+        thread = self._by_id.get(self.active)
+        if thread is None:
+            raise RuntimeError('No active frame')
+        return thread, thread.frame
+
+    def resolve(self, thread=None):
+        """Get the id of a thread given by id or name.
+
+        Without a thread the active thread is used.
+        """
+        with self.lock:
+            if thread is None:
+                if self.active is None:
+                    raise RuntimeError('No thread specified')
+                return self.active
+            if thread in self._by_id:
+                return thread
+            named = self._by_name.get(thread)
+            if named:
+                return next(iter(named))
+        raise RuntimeError('No such thread: {}'.format(thread))
@@ -0,0 +1,250 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Recording of the wire traffic with pydevd, and replay of recordings.
+
+A trace is a file of JSON lines, gzip compressed if its name ends with .gz.
+The first line describes the session, e.g.
+{"trace": 1, "started": 1507036514.2, "host": "127.0.0.1", "port": 5678}
+and every following line is one message:
+{"t": 0.004211, "d": "<", "m": "105\t2\t..."}
+where t is the time in seconds since the start of the recording, d is ">" for
+messages sent to pydevd and "<" for messages received from it, and m is the
+message without the trailing newline.
+
+Replaying a trace feeds the received messages to a PyDevClient through a
+socket, so that they go through the same reader and dispatcher as in the
+recorded session, either at the original pace or as fast as possible.
+
+Usage:
+    python -m pydevc.trace [--speed FACTOR] TRACE
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import socket
+import sys
+import threading
+import time
+
+from .transport import RECV_BUFFER_SIZE
+
+TRACE_VERSION = 1
+
+SENT = '>'
+RECEIVED = '<'
+
+# Bytes of messages written to the client at a time when replaying as fast
+# as possible.
+REPLAY_CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def open_trace(path, mode='rt'):
+    """Open a trace file, compressed if the name ends with .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class TraceRecorder:
+    """Append the messages of a connection to a trace file.
+
+    sent and received may be called from any thread, lines are written in
+    the order of the calls.
+    """
+
+    def __init__(self, path, **info):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open_trace(path, 'wt')
+        self.start = time.perf_counter()
+        self.messages = 0
+
+        header = dict(trace=TRACE_VERSION, started=time.time(), **info)
+        self.file.write(json.dumps(header) + '\n')
+
+    def __record(self, direction, messages):
+        now = round(time.perf_counter() - self.start, 6)
+        lines = ''.join(
+            json.dumps({'t': now, 'd': direction, 'm': message}) + '\n'
+            for message in messages)
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(lines)
+            self.messages += len(messages)
+
+    def sent(self, messages):
+        """Record messages sent to pydevd, with or without the newline."""
+        self.__record(SENT, [m.rstrip('\n') for m in messages])
+
+    def received(self, message):
+        """Record a message received from pydevd."""
+        self.__record(RECEIVED, [message])
+
+    def close(self):
+        """Flush and close the file, later messages are not recorded."""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_trace(path):
+    """Read a trace, returns the header and an iterator of
+    (time, direction, message)."""
+    f = open_trace(path)
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        f.close()
+        raise RuntimeError('Not a trace file: {}'.format(path)) from None
+    if header.get('trace') != TRACE_VERSION:
+        f.close()
+        raise RuntimeError('Unsupported trace version: {}'.format(
+            header.get('trace')))
+
+    def _records():
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    yield record['t'], record['d'], record['m']
+                except (ValueError, KeyError):
+                    # A partially written last line, the session was killed.
+                    logger.debug('Skipping corrupt record: %r', line)
+
+    return header, _records()
+
+
+def replay(path, client, speed=None):
+    """Feed the messages received in a trace to a client.
+
+    The client must not be connected, it is attached to one end of a socket
+    pair and started. Messages are written at their recorded times divided
+    by speed, or as fast as possible when speed is None. Returns when the
+    client has handled everything, with the number of messages and bytes
+    and the time it took. Requests the client sends are not answered, the
+    replies in the trace are delivered as they were recorded.
+    """
+    if speed is not None and not speed > 0:
+        raise RuntimeError('Replay speed must be positive: {}'.format(speed))
+    _header, records = read_trace(path)
+    ours, theirs = socket.socketpair()
+
+    # The dispatcher runs the exit callback after the last event.
+    done = threading.Event()
+    on_exit = client.callbacks.get(client.EVENT_SERVER_EXIT)
+
+    def _on_exit():
+        if on_exit is not None:
+            on_exit()
+        done.set()
+
+    client.callbacks[client.EVENT_SERVER_EXIT] = _on_exit
+    client.attach(theirs)
+    client.start()
+
+    # Whatever the client sends is read and dropped, so that it never blocks
+    # on a full socket.
+    drain = threading.Thread(target=_drain, args=(ours,), daemon=True)
+    drain.start()
+
+    messages = size = 0
+    chunk, chunk_size = [], 0
+    start = time.perf_counter()
+    for offset, direction, message in records:
+        if direction != RECEIVED:
+            continue
+        data = (message + '\n').encode('utf-8')
+        messages += 1
+        size += len(data)
+
+        if speed is None:
+            chunk.append(data)
+            chunk_size += len(data)
+            if chunk_size >= REPLAY_CHUNK_SIZE:
+                ours.sendall(b''.join(chunk))
+                chunk, chunk_size = [], 0
+            continue
+
+        delay = start + offset / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        ours.sendall(data)
+
+    if chunk:
+        ours.sendall(b''.join(chunk))
+    ours.shutdown(socket.SHUT_WR)
+    done.wait()
+    elapsed = time.perf_counter() - start
+    ours.close()
+
+    return {
+        'messages': messages,
+        'bytes': size,
+        'seconds': elapsed,
+        'messages_per_second': messages / elapsed if elapsed else None,
+    }
+
+
+def _drain(conn):
+    try:
+        while conn.recv(RECV_BUFFER_SIZE):
+            pass
+    except OSError:
+        pass
+
+
+def parse_speed(s):
+    """Parse a replay speed, a positive factor."""
+    try:
+        speed = float(s)
+    except ValueError:
+        speed = None
+    if speed is None or not speed > 0:
+        raise argparse.ArgumentTypeError(
+            'invalid speed, expected a positive number: {}'.format(s))
+    return speed
+
+
+def main(argv=None):
+    # Imported here, the client records traces with this module.
+    from .client import PyDevClient  # pylint: disable=locally-disabled, import-outside-toplevel
+
+    parser = argparse.ArgumentParser(
+        prog='python -m pydevc.trace',
+        description='Replay a trace through PyDevClient and print the '
+        'replay time and the statistics of the client as JSON.')
+    parser.add_argument('trace', help='trace file recorded with --trace')
+    parser.add_argument(
+        '--speed',
+        type=parse_speed,
+        metavar='FACTOR',
+        help='replay at FACTOR times the recorded pace, 1 for the original '
+        'pace, by default as fast as possible'
+    )
+    options = parser.parse_args(argv)
+
+    client = PyDevClient(None, None)
+    result = replay(options.trace, client, options.speed)
+    result['stats'] = client.get_stats()
+    sys.stdout.write(json.dumps(result, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
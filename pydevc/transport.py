@@ -0,0 +1,203 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Message framing for the connection to the PyDev debugger."""
+
+import logging
+import socket
+import threading
+
+# Initial size of the receive buffer. The buffer grows to fit the largest
+# message seen, and shrinks back once it has been drained.
+RECV_BUFFER_SIZE = 64 * 1024
+
+# Most buffers passed to a single sendmsg call, kept below IOV_MAX.
+MAX_WRITE_BUFFERS = 1024
+
+logger = logging.getLogger(__name__)
+
+
+class MessageReader:
+    """Split the byte stream from the server into newline-terminated messages.
+
+    Data is received with recv_into directly into a reusable buffer, every byte
+    is scanned for the separator only once, and only complete messages are
+    decoded, so multi-byte characters split between two reads are handled
+    correctly.
+
+    Iterating over the reader yields messages until the server closes the
+    connection.
+    """
+
+    def __init__(self, conn, bufsize=RECV_BUFFER_SIZE):
+        self.conn = conn
+        self.bufsize = bufsize
+        self.buf = bytearray(bufsize)
+
+        # Unconsumed data is buf[start:end], and buf[start:scanned] is known
+        # not to contain a separator.
+        self.start = 0
+        self.end = 0
+        self.scanned = 0
+
+        self.bytes_received = 0
+        self.messages_received = 0
+
+    def __iter__(self):
+        while True:
+            if not self.__recv():
+                return
+
+            while True:
+                index = self.buf.find(b'\n', self.scanned, self.end)
+                if index < 0:
+                    self.scanned = self.end
+                    break
+
+                with memoryview(self.buf) as view:
+                    message = str(view[self.start:index], 'utf-8')
+                self.start = self.scanned = index + 1
+                self.messages_received += 1
+                yield message
+
+            if self.start == self.end:
+                self.start = self.end = self.scanned = 0
+                if len(self.buf) > self.bufsize:
+                    self.buf = bytearray(self.bufsize)
+
+    def __make_room(self):
+        """Ensure there is free space after the received data."""
+        if self.end < len(self.buf):
+            return
+
+        pending = self.end - self.start
+        if self.start > 0:
+            # Move the partial message to the beginning of the buffer.
+            self.buf[:pending] = self.buf[self.start:self.end]
+            self.scanned -= self.start
+            self.start, self.end = 0, pending
+        else:
+            # A single message fills the whole buffer, double its size.
+            self.buf.extend(bytes(len(self.buf)))
+
+    def __recv(self):
+        """Receive more data, returns False when the connection is closed."""
+        self.__make_room()
+        with memoryview(self.buf) as view:
+            received = self.conn.recv_into(view[self.end:])
+        self.end += received
+        self.bytes_received += received
+        return received > 0
+
+
+class MessageWriter:
+    """Send messages to the server, coalescing bursts into single writes.
+
+    Messages are queued for the writer thread, which sends everything queued
+    at once with a single sendmsg call, so a burst of commands costs one
+    system call instead of one per command. Requests whose caller is about to
+    wait for a reply can be written immediately by the calling thread instead,
+    provided nothing is queued before them.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cond = threading.Condition()
+        self.pending = []
+        self.sending = False
+        self.closed = False
+
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.writes = 0
+
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self):
+        """Start the writer thread."""
+        self.thread.start()
+
+    def write(self, messages, immediate=False):
+        """Queue encoded messages for sending.
+
+        With immediate set, the messages are sent by the calling thread if no
+        other write is queued or in progress.
+        """
+        with self.cond:
+            if self.closed:
+                raise ConnectionError('Connection to server closed')
+            if not immediate or self.sending or self.pending:
+                self.pending.extend(messages)
+                self.cond.notify_all()
+                return
+            self.sending = True
+
+        self.__write(messages)
+
+    def flush(self, timeout=None):
+        """Wait until all queued messages have been sent."""
+        with self.cond:
+            return self.cond.wait_for(
+                lambda: self.closed or not (self.pending or self.sending),
+                timeout)
+
+    def close(self):
+        """Stop the writer, messages not yet sent are dropped."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(
+                    lambda: (self.pending and not self.sending) or self.closed)
+                if self.closed:
+                    return
+                batch, self.pending = self.pending, []
+                self.sending = True
+
+            self.__write(batch)
+
+    def __write(self, batch):
+        """Send a batch, the caller must have set the sending flag."""
+        try:
+            self.__send(batch)
+        except OSError as e:
+            logger.debug('Writing to server failed: %s', e)
+            self.close()
+        finally:
+            with self.cond:
+                self.sending = False
+                self.cond.notify_all()
+
+    def __send(self, buffers):
+        sent = 0
+        if hasattr(socket.socket, 'sendmsg'):
+            for i in range(0, len(buffers), MAX_WRITE_BUFFERS):
+                chunk = buffers[i:i + MAX_WRITE_BUFFERS]
+                total = sum(len(b) for b in chunk)
+                done = self.conn.sendmsg(chunk)
+                if done < total:
+                    # Partial write, send the rest as one buffer.
+                    self.conn.sendall(b''.join(chunk)[done:])
+                sent += total
+                self.writes += 1
+        else:
+            data = b''.join(buffers)
+            self.conn.sendall(data)
+            sent = len(data)
+            self.writes += 1
+
+        self.bytes_sent += sent
+        self.messages_sent += len(buffers)
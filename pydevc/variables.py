@@ -0,0 +1,188 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Lazily expanded trees of the variables of suspended frames."""
+
+import collections
+import threading
+
+
+class Variable:
+    """A variable in a suspended frame.
+
+    The children of a container are requested from the server only when they
+    are first accessed, and kept until the cache holding the variable is
+    invalidated.
+    """
+
+    __slots__ = ('node', 'path', '_loader', '_children')
+
+    def __init__(self, node, path, loader):
+        self.node = node
+        self.path = path
+        self._loader = loader
+        self._children = None
+
+    @property
+    def name(self):
+        return self.node['name']
+
+    @property
+    def type(self):
+        return self.node['type']
+
+    @property
+    def value(self):
+        return self.node['value']
+
+    @property
+    def qualifier(self):
+        return self.node.get('qualifier', '')
+
+    @property
+    def is_container(self):
+        return self.node.get('isContainer', '') == 'True'
+
+    def __repr__(self):
+        return '<Variable {} = {}>'.format('.'.join(self.path), self.value)
+
+    @property
+    def children(self):
+        """Child variables by name, empty if the variable is not a container.
+        """
+        if not self.is_container:
+            return collections.OrderedDict()
+        if self._children is None:
+            self._children = self._loader(self.path)
+        return self._children
+
+    def __getitem__(self, name):
+        return self.children[name]
+
+    def to_dict(self, value_length=None):
+        """Properties of the variable in the format of get_locals.
+
+        With value_length the value is cut to that many characters, and only
+        that much of it is unquoted.
+        """
+        return {
+            'type': self.type,
+            'value': (self.value if value_length is None
+                      else self.node.head('value', value_length)),
+            'qualifier': self.qualifier,
+            'container': self.is_container,
+        }
+
+
+class VariableCache:
+    """Variable trees of suspended frames, keyed by (thread id, frame id).
+
+    fetch(thread_id, frame_id, path) is called to get the variable nodes of a
+    frame (empty path) or of the container at the given path.
+    """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.lock = threading.Lock()
+        self.frames = {}
+
+        # Bumped on every invalidation, so that a frame being fetched while
+        # the thread moves on is not cached.
+        self.generation = 0
+
+    def get(self, thread_id, frame_id):
+        """Get the top-level variables of a frame by name."""
+        key = (thread_id, frame_id)
+        with self.lock:
+            if key in self.frames:
+                return self.frames[key]
+            generation = self.generation
+
+        variables = self.__load(thread_id, frame_id, ())
+        with self.lock:
+            if generation != self.generation:
+                return variables
+            return self.frames.setdefault(key, variables)
+
+    def __load(self, thread_id, frame_id, path):
+        def _loader(child_path):
+            return self.__load(thread_id, frame_id, child_path)
+
+        variables = collections.OrderedDict()
+        for node in self.fetch(thread_id, frame_id, path):
+            variable = Variable(node, path + (node['name'],), _loader)
+            variables[variable.name] = variable
+        return variables
+
+    def invalidate(self, thread_id=None):
+        """Forget cached frames of a thread, or of all threads."""
+        with self.lock:
+            self.generation += 1
+            if thread_id is None:
+                self.frames.clear()
+                return
+            for key in [k for k in self.frames if k[0] == thread_id]:
+                del self.frames[key]
+
+
+class EvaluationCache:
+    """Values of expressions evaluated in suspended frames.
+
+    Values are kept per (thread id, frame id) until the thread is stepped,
+    continued or suspends again, so an expression is evaluated at most once
+    per frame and stop. evaluate(thread_id, frame_id, expressions) is called
+    with the expressions missing from the cache and returns their values in
+    the same order.
+    """
+
+    def __init__(self, evaluate):
+        self.evaluate = evaluate
+        self.lock = threading.Lock()
+        self.frames = {}
+
+        # Bumped on every invalidation, see VariableCache.
+        self.generation = 0
+
+    def get(self, thread_id, frame_id, expression):
+        """Get the value of an expression."""
+        return self.get_many(thread_id, frame_id, [expression])[0]
+
+    def get_many(self, thread_id, frame_id, expressions):
+        """Get the values of expressions, evaluating the missing ones in one
+        batch."""
+        key = (thread_id, frame_id)
+        with self.lock:
+            cached = self.frames.get(key, {})
+            missing = list(collections.OrderedDict.fromkeys(
+                e for e in expressions if e not in cached))
+            generation = self.generation
+
+        values = {}
+        if missing:
+            values = dict(zip(missing,
+                              self.evaluate(thread_id, frame_id, missing)))
+            with self.lock:
+                if generation == self.generation:
+                    self.frames.setdefault(key, {}).update(values)
+
+        return [values[e] if e in values else cached[e] for e in expressions]
+
+    def invalidate(self, thread_id=None):
+        """Forget values in frames of a thread, or of all threads."""
+        with self.lock:
+            self.generation += 1
+            if thread_id is None:
+                self.frames.clear()
+                return
+            for key in [k for k in self.frames if k[0] == thread_id]:
+                del self.frames[key]
@@ -0,0 +1,137 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Incremental parsing of the XML payloads sent by the PyDev debugger.
+
+pydevd urlencodes the whole text of every message, and additionally escapes
+and urlencodes the attribute values inside the XML. The characters that make
+up the XML structure are left intact by the first encoding, so the payload can
+be parsed as it is, and attribute values need to be unquoted twice.
+
+Parsing is done with a pull parser fed in chunks, and attribute values are
+unquoted only when they are accessed, so large stacks and frames with
+thousands of variables are never copied as a whole.
+"""
+
+import html
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+
+# Amount of payload fed to the parser at a time.
+PARSE_CHUNK_SIZE = 64 * 1024
+
+# Longest form a single character of an attribute value takes on the wire,
+# e.g. a 4 byte UTF-8 sequence or an html entity, urlencoded twice.
+MAX_QUOTED_CHAR = 24
+
+
+def unquote(string):
+    """Remove html escaping and urlencoding. """
+    if '%' not in string and '&' not in string:
+        # Most names, ids and line numbers, skip the calls.
+        return string
+    return html.unescape(urllib.parse.unquote(string))
+
+
+class Node:
+    """An XML element whose attribute values are unquoted on first access."""
+
+    __slots__ = ('tag', 'raw', '_values')
+
+    def __init__(self, tag, raw):
+        self.tag = tag
+        self.raw = raw
+        self._values = {}
+
+    def __getitem__(self, key):
+        value = self._values.get(key)
+        if value is None:
+            value = self._values[key] = unquote(unquote(self.raw[key]))
+        return value
+
+    def head(self, key, length):
+        """Get the first length characters of an unquoted attribute value.
+
+        Only the start of the raw value is unquoted, so long values cost no
+        more than short ones.
+        """
+        value = self._values.get(key)
+        if value is None:
+            value = unquote(unquote(self.raw[key][:length * MAX_QUOTED_CHAR]))
+        return value[:length]
+
+    def __contains__(self, key):
+        return key in self.raw
+
+    def get(self, key, default=None):
+        """Get an unquoted attribute value, or default if it is missing."""
+        return self[key] if key in self.raw else default
+
+
+def iter_nodes(payload, tags):
+    """Yield a Node for each element with one of the given tags.
+
+    Nodes are yielded in document order as soon as their start tag has been
+    parsed, parsed elements are discarded right away. Payloads that fit in
+    one chunk are parsed in one go, which is cheaper for the many small
+    events.
+    """
+    if len(payload) <= PARSE_CHUNK_SIZE:
+        for elem in ET.fromstring(payload).iter():
+            if elem.tag in tags:
+                yield Node(elem.tag, elem.attrib)
+        return
+
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    stack = []
+
+    for offset in range(0, len(payload), PARSE_CHUNK_SIZE):
+        parser.feed(payload[offset:offset + PARSE_CHUNK_SIZE])
+        for event, elem in parser.read_events():
+            if event == 'start':
+                stack.append(elem)
+                if elem.tag in tags:
+                    yield Node(elem.tag, elem.attrib)
+                continue
+
+            # Detach the element so it can be freed. It is not cleared, as
+            # without the C accelerator clear() empties the attribute dict
+            # the yielded Node still refers to.
+            stack.pop()
+            if stack:
+                stack[-1].remove(elem)
+    parser.close()
+
+
+def iter_threads(payload):
+    """Yield (thread, frames) for each thread in a thread suspend payload.
+
+    Frames are listed innermost first.
+    """
+    thread, frames = None, []
+    for node in iter_nodes(payload, ('thread', 'frame')):
+        if node.tag == 'frame':
+            frames.append(node)
+            continue
+        if thread is not None:
+            yield thread, frames
+        thread, frames = node, []
+
+    if thread is not None:
+        yield thread, frames
+
+
+def iter_variables(payload):
+    """Yield a Node for each variable in a frame or evaluation payload."""
+    return iter_nodes(payload, ('var',))
@@ -0,0 +1,78 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Tests for the conditions that implement logpoints."""
+
+import sys
+import types
+import unittest
+from unittest import mock
+
+from pydevc.breakpoints import set_break_args
+from pydevc.logpoints import log_condition, parse_log_message
+
+
+class FakeDebugger:
+    """Collects the console output a logpoint writes."""
+
+    def __init__(self):
+        self.output = []
+        self.cmd_factory = self
+
+    def make_io_message(self, text, ctx, dbg):
+        self.output.append((text, ctx))
+        return object()
+
+
+class LogConditionTest(unittest.TestCase):
+
+    def setUp(self):
+        # The condition reaches the debugger through pydevd_comm, as it does
+        # inside the debuggee.
+        self.debugger = FakeDebugger()
+        comm = types.ModuleType('_pydevd_bundle.pydevd_comm')
+        comm.get_global_debugger = lambda: self.debugger
+        package = types.ModuleType('_pydevd_bundle')
+        package.pydevd_comm = comm
+        patcher = mock.patch.dict(sys.modules, {
+            '_pydevd_bundle': package,
+            '_pydevd_bundle.pydevd_comm': comm,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def messages(self):
+        return [parse_log_message(text) for text, _ in self.debugger.output]
+
+    def test_message_uses_frame_locals(self):
+        condition = log_condition(3, 'total={total} n={n}')
+        # Evaluated like pydevd does, with the globals and locals of the
+        # frame, and the locals not visible as globals.
+        frame_locals = {'total': 10, 'n': 2}
+        self.assertFalse(eval(condition, {}, frame_locals))  # pylint: disable=locally-disabled, eval-used
+        self.assertEqual(self.messages(), [(3, 'total=10 n=2')])
+
+    def test_conditioned_logpoint(self):
+        breakpoint = {
+            'id': 4, 'filename': 'a.py', 'line': 1, 'function': None,
+            'condition': 'n > 1', 'expression': None, 'hit_count': None,
+            'ignore_count': None, 'log_message': 'n={n}',
+        }
+        condition = set_break_args(breakpoint)[4]
+        for n in (1, 2):
+            self.assertFalse(eval(condition, {}, {'n': n}))  # pylint: disable=locally-disabled, eval-used
+        self.assertEqual(self.messages(), [(4, 'n=2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
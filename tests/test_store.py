@@ -0,0 +1,47 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Tests for the breakpoint store."""
+
+import os
+import tempfile
+import unittest
+
+from pydevc.store import BreakpointStore
+
+
+def breakpoint(line, log_message=None):
+    return {'filename': '/src/a.py', 'line_number': line, 'function': None,
+            'condition': None, 'expression': None, 'hit_count': None,
+            'ignore_count': None, 'log_message': log_message}
+
+
+class BreakpointStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'breakpoints.jsonl')
+
+    def test_breakpoint_and_logpoint_on_same_line(self):
+        store = BreakpointStore(self.path)
+        store.add(breakpoint(3))
+        store.add(breakpoint(3, log_message='n={n}'))
+        self.assertEqual(len(BreakpointStore(self.path).load()), 2)
+
+        store.remove(breakpoint(3, log_message='n={n}'))
+        self.assertEqual(BreakpointStore(self.path).load(), [breakpoint(3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#  Copyright (C) 2017 - 2018 Henrik Nyman <henrikjohannesnyman@gmail.com>
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Tests for parsing the XML payloads of the debugger."""
+
+import unittest
+import urllib.parse
+
+from pydevc.xmlstream import iter_variables
+
+
+def quote_value(text):
+    """Quote a value like pydevd does, urlencoded twice."""
+    return urllib.parse.quote(urllib.parse.quote(text))
+
+
+class NodeHeadTest(unittest.TestCase):
+
+    def test_head_matches_prefix_of_value(self):
+        text = 'aé"<&>\U0001f600 %25&amp;&#x1F600; ' * 50
+        payload = '<xml><var name="v" value="{}" /></xml>'.format(
+            quote_value(text))
+        value = next(iter_variables(payload))['value']
+        for length in (0, 1, 5, 7, 8, 9, 100, len(text), len(text) + 10):
+            node, = iter_variables(payload)
+            self.assertEqual(node.head('value', length), value[:length])
+
+    def test_head_after_full_value(self):
+        payload = '<xml><var name="v" value="{}" /></xml>'.format(
+            quote_value('x' * 100))
+        node, = iter_variables(payload)
+        self.assertEqual(node['value'], 'x' * 100)
+        self.assertEqual(node.head('value', 3), 'xxx')
+
+
+if __name__ == '__main__':
+    unittest.main()